@@ -0,0 +1,207 @@
+#!/usr/bin/env python
+#
+# async_tournament.py -- non-blocking client API for tournament operations
+#
+# Every Tournament method opens a connection and blocks until the query is
+# done.  An AsyncClient instead keeps a pool of open connections and runs
+# queries on a pool of worker threads, so callers get an AsyncResult back
+# straight away and can wait on it, or pass a callback, as suits them.  The
+# CPU-heavy get_pairs() work runs in a separate pool of processes, so a busy
+# pairing never holds up queries for other callers.  Roster changes and match
+# reports go through Tournament on the worker threads, so they take the same
+# lock, write the same journal and count as the same writes as any others.
+# The pools connect to the primary and replica connect() is configured with.
+#
+
+from multiprocessing import Pool
+from multiprocessing.pool import ThreadPool
+
+from psycopg2.pool import ThreadedConnectionPool
+
+import tournament
+from binning_and_graph_construction import get_pairs
+from tournament import (STATEMENTS, Tournament, TournamentConnection,
+                        executePrepared, lockTournament)
+
+
+class AsyncClient():
+    """Connection pool and worker pools shared by AsyncTournaments.
+
+    Attributes:
+      pool: psycopg2 ThreadedConnectionPool of connections to the primary
+      read_pool: ThreadedConnectionPool of connections to the replica, or
+        pool if no replica is configured
+    """
+
+    def __init__(self, connections=10, pair_processes=None):
+        """Open the pools.
+
+        Connections are made to tournament.PRIMARY_DSN, and for queries
+        that only read, to tournament.REPLICA_DSN if one is configured, as
+        connect() makes them.  The pairing processes are started before any
+        connection is opened, so they don't inherit connections they must
+        never use.
+
+        Args:
+          connections: most connections open at once to each server, and so
+            most queries running at once
+          pair_processes: number of processes computing pairings, default
+            the number of CPUs
+        """
+        self._pairings = Pool(pair_processes)
+        self._queries = ThreadPool(connections)
+        self.pool = ThreadedConnectionPool(
+            1, connections, tournament.PRIMARY_DSN,
+            connection_factory=TournamentConnection)
+        self.read_pool = self.pool
+        if tournament.REPLICA_DSN:
+            self.read_pool = ThreadedConnectionPool(
+                1, connections, tournament.REPLICA_DSN,
+                connection_factory=TournamentConnection)
+
+    def _execute(self, query, args, fetch, read=False, lock=None):
+        pool = self.read_pool if read else self.pool
+        conn = pool.getconn()
+        try:
+            cursor = conn.cursor()
+            if lock is not None:
+                lockTournament(cursor, lock)
+            if query in STATEMENTS:
+                executePrepared(cursor, query, args)
+            else:
+                cursor.execute(query, args)
+            result = None
+            if fetch == 'one':
+                result = cursor.fetchone()
+            elif fetch == 'all':
+                result = cursor.fetchall()
+            conn.commit()
+            return result
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            pool.putconn(conn)
+
+    def execute(self, query, args=(), fetch=None, callback=None, read=False,
+                lock=None):
+        """Run a query on a pooled connection in the background.
+
+        Args:
+          query: SQL to run, or the name of one of tournament.STATEMENTS,
+            which is prepared once per pooled connection
+          args: query parameters
+          fetch: None for no result, 'one' for fetchone() or 'all' for
+            fetchall()
+          callback: optional function called with the result when done
+          read: whether the query only reads, so can run on the replica
+          lock: id of a tournament whose exclusive advisory lock is taken
+            first, as lockTournament() takes it, or None
+
+        Returns:
+          AsyncResult whose get() returns the fetched result
+        """
+        return self._queries.apply_async(
+            self._execute, (query, args, fetch, read, lock),
+            callback=callback)
+
+    def run(self, function, args=(), callback=None):
+        """Call a function on one of the query threads in the background.
+
+        Returns:
+          AsyncResult whose get() returns what the function returned
+        """
+        return self._queries.apply_async(function, args, callback=callback)
+
+    def _pair(self, tournament_id, engine, on_infeasible, lookahead):
+        pairing_info = self._execute('pairing_info', [tournament_id], 'all',
+                                     lock=tournament_id)
+        return self._pairings.apply(
+            get_pairs, (pairing_info, engine, on_infeasible, lookahead))
+
+    def pair(self, tournament_id, engine='blossom', on_infeasible='rematch',
+             lookahead=0, callback=None):
+        """Pair the next round of a tournament in the background.
+
+        Pairing info is read on a pooled connection to the primary, under
+        the tournament's exclusive advisory lock as in
+        Tournament.swissPairings(), and get_pairs() runs in one of the
+        pairing processes.
+
+        Returns:
+          AsyncResult whose get() returns the list of pairings
+        """
+        return self._queries.apply_async(
+            self._pair, (tournament_id, engine, on_infeasible, lookahead),
+            callback=callback)
+
+    def tournament(self, id, name=None, journal_dir=None,
+                   read_your_writes=False):
+        """Return an AsyncTournament for an existing tournament id."""
+        return AsyncTournament(self, id, name, journal_dir, read_your_writes)
+
+    def close(self):
+        """Wait for outstanding work, then close the pools."""
+        self._queries.close()
+        self._queries.join()
+        self._pairings.close()
+        self._pairings.join()
+        if self.read_pool is not self.pool:
+            self.read_pool.closeall()
+        self.pool.closeall()
+
+
+class AsyncTournament():
+    """Non-blocking versions of the busiest Tournament methods.
+
+    Each method returns an AsyncResult at once; call get() on it to wait for
+    the result, or pass callback to have it called with the result.
+
+    Attributes:
+      client: AsyncClient whose pools are used
+      id: id of the tournament
+      name: name of the tournament, if known
+      tournament: Tournament that roster changes and match reports are
+        made through
+    """
+
+    def __init__(self, client, id, name=None, journal_dir=None,
+                 read_your_writes=False):
+        """journal_dir and read_your_writes are as for Tournament."""
+        self.client = client
+        self.id = id
+        self.name = name
+        self.tournament = Tournament(name, id, journal_dir, read_your_writes)
+
+    def close(self):
+        """Close the tournament's journal, if it has one."""
+        self.tournament.close()
+
+    def enterPlayer(self, player_id, callback=None):
+        """Enters an existing player as Tournament.enterPlayer()."""
+        return self.client.run(self.tournament.enterPlayer, (player_id,),
+                               callback)
+
+    def reportMatch(self, winner, loser, draw=False, round=None, board=None,
+                    callback=None):
+        """Records the outcome of a match as Tournament.reportMatch()."""
+        return self.client.run(self.tournament.reportMatch,
+                               (winner, loser, draw, round, board), callback)
+
+    def playerStandings(self, callback=None):
+        """Returns standings as in Tournament.playerStandings().
+
+        With read_your_writes, they're read through the Tournament, so they
+        include this object's own writes.
+        """
+        if self.tournament.read_your_writes:
+            return self.client.run(self.tournament.playerStandings, (),
+                                   callback)
+        return self.client.execute('standings', [self.id], 'all',
+                                   callback=callback, read=True)
+
+    def swissPairings(self, engine='blossom', on_infeasible='rematch',
+                      lookahead=0, callback=None):
+        """Returns pairings as in Tournament.swissPairings()."""
+        return self.client.pair(self.id, engine, on_infeasible, lookahead,
+                                callback)
@@ -0,0 +1,424 @@
+#!/usr/bin/env python
+#
+# benchmark.py -- timing and quality checks for the pairing engines
+#
+# The quality, timing, memory and projection reports run entirely in memory:
+# fields are simulated by feeding get_pairs() its own results round after
+# round, so no database is needed.  The projection report needs NumPy.  The
+# contention, latency and sql reports need the tournament database, and the
+# sql report is meant to be run on data from generate_data.py.  The startup
+# report times fresh interpreters running the command-line tool, and needs the
+# database only if given a tournament to read.
+#
+
+import argparse
+import os
+import random
+import resource
+import subprocess
+import sys
+import threading
+import time
+from multiprocessing import Pool
+
+from binning_and_graph_construction import BYE, compare_engines, get_pairs
+from journal import ENTER, MATCH, TournamentState
+
+DRAW_RATE = 0.1         # chance any non-bye match is drawn
+BLOSSOM_SIZES = [256]   # field sizes the memory report also pairs exactly
+
+
+def simulate_tournament(num_players, rounds, rng, draw_rate=DRAW_RATE,
+                        engine='blossom'):
+    """Play out a tournament with get_pairs() pairing each round.
+
+    Players are numbered from BYE + 1, so the same random choices give the
+    same tournament whatever ids the players have in the database.  Players
+    who can't be paired without a rematch sit the round out.
+
+    Args:
+      num_players: number of players in the field
+      rounds: number of rounds to play
+      rng: random.Random the results are drawn from
+      draw_rate: chance of each match being drawn
+      engine: pairing engine, as taken by get_pairs()
+
+    Returns:
+      (state, results): the TournamentState after the last round, and a list
+      of (round, board, winner, loser, draw) tuples in the order played,
+      with byes as wins over BYE
+    """
+    state = TournamentState()
+    for id in range(BYE + 1, BYE + 1 + num_players):
+        state.apply(ENTER, id, name=u'Player {}'.format(id))
+    results = []
+    for round in range(1, rounds + 1):
+        pairings = state.swissPairings(engine, 'partial')
+        for board, (id1, _, id2, _) in enumerate(pairings, 1):
+            result = rng.random()
+            draw = id2 != BYE and result < draw_rate
+            if id2 == BYE or draw or result < (1 + draw_rate) / 2:
+                winner, loser = id1, id2
+            else:
+                winner, loser = id2, id1
+            state.apply(MATCH, winner, loser, draw)
+            results.append((round, board, winner, loser, draw))
+    return state, results
+
+
+def simulate_field(num_players, rounds, engine='greedy', seed=0):
+    """Simulate a Swiss field for a number of rounds.
+
+    Results are drawn at random with DRAW_RATE draws, as in
+    simulate_tournament().
+
+    Args:
+      num_players: number of players in the field
+      rounds: number of rounds to play
+      engine: pairing engine used to pair each round
+      seed: seed for the random results, so runs are repeatable
+
+    Returns:
+      List of player tuples in standings order, as taken by get_pairs()
+    """
+    state, _ = simulate_tournament(num_players, rounds, random.Random(seed),
+                                   engine=engine)
+    return state.playerInfo()
+
+
+def quality_report(sizes, rounds, engine='greedy', seed=0):
+    """Print engine weight against the exact matcher for each field size."""
+    print '{:>8} {:>12} {:>12} {:>8} {:>10} {:>10}'.format(
+        'players', 'exact wt', 'engine wt', 'unpaired', 'exact s', 'engine s')
+    for size in sizes:
+        info = simulate_field(size, rounds, engine, seed)
+        report = compare_engines(info, engine)
+        print '{:>8} {:>12} {:>12} {:>8} {:>10.4f} {:>10.4f}'.format(
+            report['players'], report['exact_weight'], report['weight'],
+            report['unpaired'], report['exact_seconds'], report['seconds'])
+
+
+def timing_report(sizes, rounds, engine='greedy', seed=0):
+    """Print time taken by an engine to pair one round at each field size."""
+    print '{:>8} {:>10}'.format('players', 'seconds')
+    for size in sizes:
+        info = simulate_field(size, rounds, engine, seed)
+        start = time.time()
+        get_pairs(info, engine)
+        print '{:>8} {:>10.4f}'.format(size, time.time() - start)
+
+
+def _pairing_memory(size, rounds, engine, seed):
+    # Runs in a fresh process, since peak RSS never goes back down
+    info = simulate_field(size, rounds, 'greedy', seed)
+    before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.time()
+    get_pairs(info, engine)
+    seconds = time.time() - start
+    after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return before, after, seconds
+
+
+def memory_report(sizes, rounds, engine='greedy', seed=0, max_rss=None,
+                  blossom_sizes=BLOSSOM_SIZES):
+    """Print peak resident memory while an engine pairs one round at each
+    field size.
+
+    Each size is simulated with the greedy engine and paired with engine in
+    a new process, so earlier sizes don't raise the peak.  The blossom
+    engine is too slow for the sizes greedy is measured at, so it is also
+    measured at the smaller blossom_sizes, and held to the same ceiling.
+
+    Args:
+      sizes: list of field sizes
+      rounds: number of rounds played before the round that is paired
+      engine: pairing engine whose memory use is measured
+      seed: seed for the simulated results
+      max_rss: optional ceiling on peak RSS in MB
+      blossom_sizes: list of field sizes to pair with the blossom engine
+        too, if engine isn't blossom already
+
+    Returns:
+      True if every size stayed under max_rss, or max_rss was not given
+    """
+    runs = [(engine, size) for size in sizes]
+    if engine != 'blossom':
+        runs += [('blossom', size) for size in blossom_sizes]
+    print '{:>8} {:>8} {:>12} {:>12} {:>10}'.format(
+        'engine', 'players', 'peak MB', 'pairing MB', 'seconds')
+    within = True
+    for run_engine, size in runs:
+        pool = Pool(1, maxtasksperchild=1)
+        before, after, seconds = pool.apply(_pairing_memory,
+                                            (size, rounds, run_engine, seed))
+        pool.close()
+        pool.join()
+        # ru_maxrss is in kilobytes on Linux
+        peak = after / 1024.0
+        print '{:>8} {:>8} {:>12.1f} {:>12.1f} {:>10.4f}'.format(
+            run_engine, size, peak, (after - before) / 1024.0, seconds)
+        if max_rss is not None and peak > max_rss:
+            within = False
+    return within
+
+
+def projection_report(sizes, rounds, simulations, seed=0):
+    """Print time taken to project final standings at each field size.
+
+    Fields are simulated for rounds rounds, then projected for as many
+    more.
+    """
+    from projection import project_standings
+
+    print '{:>8} {:>12} {:>10}'.format('players', 'simulations', 'seconds')
+    for size in sizes:
+        info = simulate_field(size, rounds, 'greedy', seed)
+        start = time.time()
+        project_standings(info, rounds, simulations, seed=seed)
+        print '{:>8} {:>12} {:>10.4f}'.format(size, simulations,
+                                              time.time() - start)
+
+
+def contention_report(writer_counts, reports, num_players=64):
+    """Print report throughput and lock waits as concurrent writers grow.
+
+    For each writer count, a new tournament is registered and that many
+    threads each report matches on their own boards, while one more thread
+    keeps asking for pairings.  Waits are for the tournament's advisory
+    lock; reports sharing players also wait on each other's player_scores
+    rows, which shows in the throughput.
+
+    Args:
+      writer_counts: list of numbers of concurrent writers to try
+      reports: number of reports each writer makes
+      num_players: number of players entered in each tournament
+    """
+    from tournament import Tournament, registerPlayer
+
+    print '{:>8} {:>10} {:>14} {:>14} {:>14}'.format(
+        'writers', 'reports/s', 'mean wait ms', 'max wait ms', 'pair wait ms')
+    players = [registerPlayer('Player {}'.format(i))
+               for i in range(num_players)]
+    for writers in writer_counts:
+        t = Tournament('Contention {} writers'.format(writers))
+        for p in players:
+            t.enterPlayer(p)
+        waits = []
+        pair_waits = []
+        done = threading.Event()
+
+        def write(round):
+            writer = Tournament(t.name, t.id)
+            for board in range(reports):
+                p1, p2 = random.sample(players, 2)
+                writer.reportMatch(p1, p2, round=round, board=board)
+                waits.append(writer.lock_wait)
+
+        def pair():
+            pairer = Tournament(t.name, t.id)
+            while not done.is_set():
+                pairer.swissPairings('greedy')
+                pair_waits.append(pairer.lock_wait)
+
+        threads = [threading.Thread(target=write, args=(round,))
+                   for round in range(writers)]
+        pairer = threading.Thread(target=pair)
+        start = time.time()
+        pairer.start()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        seconds = time.time() - start
+        done.set()
+        pairer.join()
+        print '{:>8} {:>10.0f} {:>14.2f} {:>14.2f} {:>14.2f}'.format(
+            writers, len(waits) / seconds,
+            1000 * sum(waits) / len(waits), 1000 * max(waits),
+            1000 * sum(pair_waits) / max(len(pair_waits), 1))
+
+
+# Query functions of tournament.sql that take a tournament id
+SQL_FUNCTIONS = [
+    'get_players_from_tourn', 'get_matches_from_tourn',
+    'get_standings_from_tourn', 'get_player_opponents_from_tourn',
+    'compute_player_scores_from_tourn', 'get_ranked_standings_from_tourn',
+    'aggregate_player_opponents_from_tourn',
+    'get_info_for_pairing_from_tourn',
+]
+
+
+def sql_report(repeats):
+    """Print mean time taken by each SQL query function on the tournament
+    with the most matches, as filled in by generate_data.py.
+
+    Args:
+      repeats: number of times to run each function
+    """
+    from tournament import connect
+
+    conn, cursor = connect()
+    cursor.execute("""SELECT tournament, COUNT(*) FROM matches
+                      GROUP BY tournament ORDER BY COUNT(*) DESC LIMIT 1;""")
+    tournament_id, matches = cursor.fetchone()
+    print 'Tournament {}, {} matches'.format(tournament_id, matches)
+    print '{:>40} {:>8} {:>10}'.format('function', 'rows', 'ms')
+    for function in SQL_FUNCTIONS:
+        query = 'SELECT COUNT(*) FROM {}(%s);'.format(function)
+        start = time.time()
+        for i in range(repeats):
+            cursor.execute(query, [tournament_id])
+            rows = cursor.fetchone()[0]
+        print '{:>40} {:>8} {:>10.3f}'.format(
+            function, rows, 1000 * (time.time() - start) / repeats)
+    conn.close()
+
+
+def latency_report(calls, num_players=64):
+    """Print mean per-call latency of the hot queries, with and without
+    pooled connections and prepared statements.
+
+    Args:
+      calls: number of calls to time for each method
+      num_players: number of players entered in the tournament
+    """
+    import tournament
+
+    t = tournament.Tournament('Latency')
+    players = [tournament.registerPlayer('Player {}'.format(i))
+               for i in range(num_players)]
+    for p in players:
+        t.enterPlayer(p)
+    for i in range(0, num_players, 2):
+        t.reportMatch(players[i], players[i+1])
+
+    methods = [
+        ('countPlayers', t.countPlayers),
+        ('playerStandings', t.playerStandings),
+        ('reportMatch', lambda: t.reportMatch(*random.sample(players, 2))),
+        ('swissPairings', lambda: t.swissPairings('greedy')),
+    ]
+    setups = [('plain', 0, False), ('pooled', 4, False),
+              ('pooled+prepared', 4, True)]
+    print '{:>16}'.format('ms per call') + ''.join(
+        '{:>18}'.format(label) for label, _, _ in setups)
+    results = dict((name, []) for name, _ in methods)
+    saved = tournament.POOL_SIZE, tournament.PREPARE
+    try:
+        for label, pool_size, prepare in setups:
+            tournament.POOL_SIZE, tournament.PREPARE = pool_size, prepare
+            tournament.closePool()
+            for name, method in methods:
+                method()                # warm up, and prepare if need be
+                start = time.time()
+                for i in range(calls):
+                    method()
+                results[name].append(1000 * (time.time() - start) / calls)
+    finally:
+        tournament.POOL_SIZE, tournament.PREPARE = saved
+        tournament.closePool()
+    for name, _ in methods:
+        print '{:>16}'.format(name) + ''.join(
+            '{:>18.3f}'.format(ms) for ms in results[name])
+
+
+# Commands timed by the startup report, each run in a fresh interpreter.  The
+# tournament's commands are only run if a tournament id is given
+STARTUP_COMMANDS = [
+    ('import tournament', ['-c', 'import tournament']),
+    ('import matching engine',
+     ['-c', 'import binning_and_graph_construction']),
+    ('tournament --help', ['tournament_cli.py', '--help']),
+]
+TOURNAMENT_COMMANDS = [
+    ('tournament standings', ['tournament_cli.py', 'standings']),
+    ('tournament pair', ['tournament_cli.py', 'pair', '--engine', 'greedy']),
+]
+
+
+def startup_report(repeats, tournament_id=None, max_ms=None):
+    """Print the median wall time of each command in STARTUP_COMMANDS, from
+    starting a fresh interpreter to its exit.
+
+    Args:
+      repeats: number of times to run each command
+      tournament_id: tournament to run TOURNAMENT_COMMANDS on, if any
+      max_ms: optional limit on the median time of the command-line tool's
+        commands, in milliseconds
+
+    Returns:
+      True if no command-line tool command took longer than max_ms
+    """
+    commands = list(STARTUP_COMMANDS)
+    if tournament_id is not None:
+        commands += [(label, args + [str(tournament_id)])
+                     for label, args in TOURNAMENT_COMMANDS]
+    here = os.path.dirname(os.path.abspath(__file__))
+    within = True
+    print '{:>24} {:>10}'.format('command', 'ms')
+    with open(os.devnull, 'w') as devnull:
+        for label, args in commands:
+            times = []
+            for i in range(repeats):
+                start = time.time()
+                subprocess.check_call([sys.executable] + args, cwd=here,
+                                      stdout=devnull)
+                times.append(1000 * (time.time() - start))
+            ms = sorted(times)[len(times) // 2]
+            print '{:>24} {:>10.1f}'.format(label, ms)
+            if (max_ms is not None and label.startswith('tournament ') and
+                    ms > max_ms):
+                within = False
+    return within
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Timing and quality checks for the pairing engines.')
+    parser.add_argument('report', choices=['quality', 'timing', 'memory',
+                                           'projection', 'contention',
+                                           'latency', 'sql', 'startup'])
+    parser.add_argument('--sizes', type=int, nargs='+',
+                        default=[16, 64, 256])
+    parser.add_argument('--rounds', type=int, default=5)
+    parser.add_argument('--engine', default='greedy')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--writers', type=int, nargs='+',
+                        default=[1, 2, 4, 8, 16, 32])
+    parser.add_argument('--reports', type=int, default=200)
+    parser.add_argument('--calls', type=int, default=200)
+    parser.add_argument('--simulations', type=int, default=10000)
+    parser.add_argument('--max-rss', type=float,
+                        help='fail the memory report above this peak RSS, MB')
+    parser.add_argument('--blossom-sizes', type=int, nargs='*',
+                        default=BLOSSOM_SIZES,
+                        help='field sizes the memory report also pairs with '
+                             'the blossom engine')
+    parser.add_argument('--tournament', type=int,
+                        help='tournament id the startup report reads')
+    parser.add_argument('--max-ms', type=float,
+                        help='fail the startup report if a command takes '
+                             'longer, ms')
+    args = parser.parse_args()
+    if args.report == 'quality':
+        quality_report(args.sizes, args.rounds, args.engine, args.seed)
+    elif args.report == 'timing':
+        timing_report(args.sizes, args.rounds, args.engine, args.seed)
+    elif args.report == 'memory':
+        if not memory_report(args.sizes, args.rounds, args.engine, args.seed,
+                             args.max_rss, args.blossom_sizes):
+            sys.exit('Peak RSS above {} MB'.format(args.max_rss))
+    elif args.report == 'projection':
+        projection_report(args.sizes, args.rounds, args.simulations,
+                          args.seed)
+    elif args.report == 'contention':
+        random.seed(args.seed)
+        contention_report(args.writers, args.reports)
+    elif args.report == 'latency':
+        random.seed(args.seed)
+        latency_report(args.calls)
+    elif args.report == 'sql':
+        sql_report(args.calls)
+    else:
+        if not startup_report(args.calls, args.tournament, args.max_ms):
+            sys.exit('Startup above {} ms'.format(args.max_ms))
@@ -0,0 +1,192 @@
+#!/usr/bin/env python
+#
+# binary_export.py -- compact binary snapshot format for a single tournament
+#
+# A snapshot holds everything needed to move a tournament to another
+# database, or to pair it offline, in a handful of fixed-width arrays:
+#
+#   header: 4 byte magic 'TEXP', 2 byte version, tournament name length (2),
+#           player count (4), opponent count (4), match count (4), followed by
+#           the utf-8 tournament name
+#   players, in standings order:
+#     ids, wins, draws, losses, opp_pts        int32[players] each
+#     name_offsets                             int32[players + 1]
+#     names                                    utf-8 bytes, concatenated
+#   packed opponent adjacency, oldest first:
+#     opp_offsets                              int32[players + 1]
+#     opponents                                int32[opponent count]
+#   matches, in the order they were reported:
+#     winners, losers                          int32[matches] each
+#     draws                                    uint8[matches]
+#
+# All integers are little-endian.  Arrays are read with array.fromfile(), one
+# block copy per array and no Python object per element, and PlayerInfoView
+# hands the arrays to get_pairs() without building a list of player tuples.
+#
+
+import struct
+import sys
+from array import array
+
+MAGIC = 'TEXP'
+VERSION = 1
+HEADER = struct.Struct('<4sHHIII')
+
+
+def _write_array(f, typecode, values):
+    data = array(typecode, values)
+    if sys.byteorder == 'big':
+        data.byteswap()
+    data.tofile(f)
+
+
+def _read_array(f, typecode, count):
+    data = array(typecode)
+    data.fromfile(f, count)
+    if sys.byteorder == 'big':
+        data.byteswap()
+    return data
+
+
+def write_export(path, name, player_info, matches):
+    """Write a tournament snapshot to path.
+
+    Args:
+      path: path of the file to write
+      name: tournament name
+      player_info: list of player tuples in standings order, as returned by
+        get_info_for_pairing_from_tourn() and taken by get_pairs()
+      matches: list of (winner, loser, draw) tuples in the order reported
+    """
+    if isinstance(name, unicode):
+        name = name.encode('utf-8')
+    names = [p[1].encode('utf-8') if isinstance(p[1], unicode) else p[1]
+             for p in player_info]
+    opponents = [[o for o in p[5] if o is not None] for p in player_info]
+    name_offsets = [0]
+    for n in names:
+        name_offsets.append(name_offsets[-1] + len(n))
+    opp_offsets = [0]
+    for o in opponents:
+        opp_offsets.append(opp_offsets[-1] + len(o))
+    with open(path, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, VERSION, len(name), len(player_info),
+                            opp_offsets[-1], len(matches)))
+        f.write(name)
+        for column in range(5):
+            if column == 1:
+                continue            # names are written separately below
+            _write_array(f, 'i', (p[column] for p in player_info))
+        _write_array(f, 'i', (p[6] or 0 for p in player_info))
+        _write_array(f, 'i', name_offsets)
+        f.write(''.join(names))
+        _write_array(f, 'i', opp_offsets)
+        _write_array(f, 'i', (o for opps in opponents for o in opps))
+        _write_array(f, 'i', (m[0] for m in matches))
+        _write_array(f, 'i', (m[1] for m in matches))
+        _write_array(f, 'B', (bool(m[2]) for m in matches))
+
+
+class TournamentExport():
+    """A tournament snapshot read back from a file.
+
+    Attributes:
+      name: tournament name
+      ids, wins, draws, losses, opp_pts: int arrays, one entry per player in
+        standings order
+      name_offsets, names: player names, names[name_offsets[i]:
+        name_offsets[i+1]] being the utf-8 name of player i
+      opp_offsets, opponents: opponents[opp_offsets[i]:opp_offsets[i+1]] are
+        the ids of player i's opponents, oldest first
+      winners, losers, draw_flags: one entry per match in report order
+    """
+
+    def __init__(self, path):
+        """Read the snapshot at path."""
+        with open(path, 'rb') as f:
+            header = f.read(HEADER.size)
+            if len(header) < HEADER.size:
+                raise ValueError("{} is not a tournament export".format(path))
+            (magic, version, name_length, num_players, num_opponents,
+             num_matches) = HEADER.unpack(header)
+            if magic != MAGIC:
+                raise ValueError("{} is not a tournament export".format(path))
+            if version != VERSION:
+                raise ValueError("{} is export version {}, expected {}".format(
+                    path, version, VERSION))
+            self.name = f.read(name_length).decode('utf-8')
+            self.ids = _read_array(f, 'i', num_players)
+            self.wins = _read_array(f, 'i', num_players)
+            self.draws = _read_array(f, 'i', num_players)
+            self.losses = _read_array(f, 'i', num_players)
+            self.opp_pts = _read_array(f, 'i', num_players)
+            self.name_offsets = _read_array(f, 'i', num_players + 1)
+            self.names = f.read(self.name_offsets[-1])
+            self.opp_offsets = _read_array(f, 'i', num_players + 1)
+            self.opponents = _read_array(f, 'i', num_opponents)
+            self.winners = _read_array(f, 'i', num_matches)
+            self.losers = _read_array(f, 'i', num_matches)
+            self.draw_flags = _read_array(f, 'B', num_matches)
+
+    def playerName(self, i):
+        """Return the name of the player at standings position i."""
+        start, end = self.name_offsets[i], self.name_offsets[i+1]
+        return self.names[start:end].decode('utf-8')
+
+    def matches(self):
+        """Return an iterator of (winner, loser, draw) in report order."""
+        return ((w, l, bool(d)) for w, l, d in
+                zip(self.winners, self.losers, self.draw_flags))
+
+    def playerInfo(self):
+        """Return the players as a sequence get_pairs() can take directly."""
+        return PlayerInfoView(self)
+
+
+class PlayerInfoView(object):
+    """Read-only sequence of player tuples backed by a TournamentExport.
+
+    Each row is built from the arrays only when it is accessed, and its
+    opponents are an array slice rather than a list.
+    """
+
+    def __init__(self, export):
+        self.export = export
+        self.extra = []         # rows appended by simple_pairing()
+
+    def __len__(self):
+        return len(self.export.ids) + len(self.extra)
+
+    def __getitem__(self, i):
+        e = self.export
+        if i < 0:
+            i += len(self)
+        if i >= len(e.ids):
+            return self.extra[i - len(e.ids)]
+        return (e.ids[i], e.playerName(i), e.wins[i], e.draws[i],
+                e.losses[i], e.opponents[e.opp_offsets[i]:e.opp_offsets[i+1]],
+                e.opp_pts[i])
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def append(self, row):
+        self.extra.append(row)
+
+
+def copy_escape(value):
+    """Escape a value for PostgreSQL COPY text format."""
+    if value is None:
+        return '\\N'
+    if isinstance(value, unicode):
+        value = value.encode('utf-8')
+    value = str(value)
+    return (value.replace('\\', '\\\\').replace('\t', '\\t')
+            .replace('\n', '\\n').replace('\r', '\\r'))
+
+
+def copy_rows(rows):
+    """Return rows as a COPY text format string, one line per row."""
+    return ''.join('\t'.join(copy_escape(v) for v in row) + '\n'
+                   for row in rows)
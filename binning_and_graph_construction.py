@@ -42,7 +42,28 @@ The idea for using maximum weight matching came from the Leaguevine blog:
 https://www.leaguevine.com/blog/18/
 swiss-tournament-scheduling-leaguevines-new-algorithm/
 
-get_pairs(player_info) arguments and return:
+Building every edge is O(n^2) and general matching is slower still, which is
+out of reach for very large fields.  For those, get_pairs(player_info,
+engine='greedy') walks the same bins top down, pairing each group top half
+against bottom half and fixing rematches with bounded local backtracking and
+floaters, in close to linear time.  Anyone the pass leaves out is paired by
+augmenting paths, so it pairs as many players as the exact matcher does.
+compare_engines() reports how much weight it gives up against the exact
+matcher on fields where both can run.
+
+Late in an event a full pairing with no rematches may not exist.  Rather than
+let the weighted solve find that out the hard way, get_pairs() first runs the
+cheap feasible_matching() check and, by default, forgives the least recent
+rounds of opponents until everyone can be paired.  Byes are never forgiven.
+The greedy engine's pairing is the one the check finds.
+
+Small events can also pair themselves into a corner: a round pairs fine but
+leaves no rematch-free pairing for a later one.  get_pairs(player_info,
+lookahead=n) checks that the n rounds after this one can still be paired and
+tries a few alternatives if not.
+
+get_pairs(player_info, engine, on_infeasible, lookahead) arguments and
+return:
     Args:
       player_info: list of tuples of form (id, name, wins, draws, losses,
         [opponents], opp_pts)
@@ -53,6 +74,9 @@ get_pairs(player_info) arguments and return:
         losses (long): number of losses player has
         opponents (int[]): list of opponent ids player has already played
         opp_pts (long): number of total points opponents have (3 win, 1 draw)
+      engine: 'blossom' (default) or 'greedy'
+      on_infeasible: 'rematch' (default), 'partial' or 'raise'
+      lookahead: rounds left after this one to keep pairable, default 0
         
     Returns:
       List of tuples of form (id1, name1, id2, name2) giving match pairs
@@ -62,6 +86,7 @@ Created on Sat Feb 28 22:13:15 2015
 @author: Michael K. Maddeford
 """
 
+import time
 from collections import OrderedDict
 from networkx import Graph
 from networkx.algorithms.matching import max_weight_matching
@@ -157,12 +182,12 @@ def simple_pairing(player_info):
     return pairings
 
 
-# Create list of tuples (player1, player 2, weight) which will be used to 
+# Generate tuples (player1, player 2, weight) which will be used to 
 # construct a graph of player nodes with weighted edges.  Weights are 
-# determined by relative position within bin and between bins
+# determined by relative position within bin and between bins.  There are
+# O(n^2) edges, so they are yielded one at a time for the graph to take as
+# they come rather than collected into a list first
 def get_weighted_edges(bins):
-    weighted_edges = []
-    
     # Weight penalty for moving between bins - make twice the distance of max
     # bin
     bin_weight = max(len(bins[x]) for x in bins) * 2
@@ -178,7 +203,7 @@ def get_weighted_edges(bins):
                     start = j+1
                 else:
                     start = 0               # else start at first player in bin
-                for l in range(start, len(group)):
+                for l in range(start, len(bin_lists[k])):
                     opponent = bin_lists[k][l]
                     # if opponent not already played
                     if not (opponent.id in player.played or \
@@ -199,17 +224,345 @@ def get_weighted_edges(bins):
                             # if in a different bin, weight by distance from
                             # player and add bin_weight per bin distance
                             weight = -(bin_weight * (k-i) + l)
-                        weighted_edges.append((player.id, opponent.id, weight))
+                        yield player.id, opponent.id, weight
                     # else if opponent is 'bye' and haven't had a bye yet,
                     # player is eligible for a bye
                     elif opponent.id == BYE and not player.had_bye:
                         weight = -(bin_weight * (k-i) + l)
-                        weighted_edges.append((player.id, opponent.id, weight))
+                        yield player.id, opponent.id, weight
+
+
+# Return True if neither player has already played the other.  The bye
+# player's played list holds everyone who has had a bye, so this covers byes
+def can_play(player, opponent):
+    return not (opponent.id in player.played or player.id in opponent.played)
+
+
+# Find the best unpaired opponent for player among the pending players of a
+# group.  Search starts at the preferred (top half vs bottom half) spot and
+# moves outward one position at a time, looking at no more than window
+# players, so the cost per player is bounded regardless of field size
+def find_opponent(player, pending, window):
+    preferred = (len(pending) - 1) / 2
+    for step in range(min(window, len(pending))):
+        # alternate below then above the preferred spot: 0, +1, -1, +2, ...
+        if step % 2 == 0:
+            index = preferred + step / 2
+        else:
+            index = preferred - (step + 1) / 2
+        if 0 <= index < len(pending) and can_play(player, pending[index]):
+            return index
+    return None
+
+
+# Bounded local backtracking.  When player has no legal opponent left in the
+# window, look back over the last few pairs made in this group for a pair
+# (a, b) where player can take b and a can take someone still pending.
+# Returns (pair_index, pending_index) or None
+def find_exchange(player, made, pending, window, max_backtrack):
+    for m in range(len(made) - 1, max(len(made) - max_backtrack, 0) - 1, -1):
+        a, b = made[m]
+        if not can_play(player, b):
+            continue
+        index = find_opponent(a, pending, window)
+        if index is not None:
+            return m, index
+    return None
+
+
+# Pair off a single score group greedily, highest ranked player first, with
+# each player taking the nearest legal opponent to their ideal slide pairing.
+# Players who can't be paired even after backtracking float down and are
+# returned so they can be placed at the top of the next group
+def pair_group(group, matches, window, max_backtrack):
+    pending = list(group)
+    made = []
+    floaters = []
+    while pending:
+        player = pending.pop(0)
+        index = find_opponent(player, pending, window)
+        if index is not None:
+            made.append((player, pending.pop(index)))
+            continue
+        exchange = find_exchange(player, made, pending, window, max_backtrack)
+        if exchange is not None:
+            m, index = exchange
+            a, b = made[m]
+            made[m] = (a, pending.pop(index))
+            made.append((player, b))
+            continue
+        floaters.append(player)
+    for a, b in made:
+        matches[a.id] = b.id
+        matches[b.id] = a.id
+    return floaters
+
+
+# Near-linear alternative to max weight matching for very large fields.
+# Walks the bins from the top down pairing each group top half against
+# bottom half, fixing rematches with bounded local backtracking and floating
+# unpairable players down into the next group.  Anyone still unpaired at the
+# bottom gets one last pass with an unbounded search, and then complete()
+# pairs whoever is left, so the result is as complete as any rematch-free
+# pairing can be.  Returns a dictionary of player:opponent pairs in the same
+# form as max_weight_matching()
+def greedy_matching(bins, window=8, max_backtrack=4):
+    matches = {}
+    floaters = []
+    for group in bins.values():
+        floaters = pair_group(floaters + group, matches, window, max_backtrack)
+    if floaters:
+        floaters = pair_group(floaters, matches, len(floaters),
+                              len(floaters))
+    if floaters:
+        matches = complete(bins, matches, floaters)
+    return matches
+
+
+# Search for an augmenting path from an unpaired player: a path through the
+# rematch-free graph to another unpaired player whose every second edge is a
+# pair already made.  Swapping the pairs along it pairs both ends and keeps
+# everyone else paired.  Each player reached is checked against the whole
+# field, but a path is usually found within a step or two.  Blossoms (odd
+# cycles) aren't contracted, so a path can be missed but never made up.
+# Returns True and updates matches if a path was found
+def augment(start, players, by_id, matches):
+    parent = {start.id: None}       # player : player they were reached from
+    queue = [start]
+    for player in queue:
+        for opponent in players:
+            if opponent.id in parent or not can_play(player, opponent):
+                continue
+            if opponent.id not in matches:
+                # Pair along the path, back to start
+                inner, outer = opponent.id, player.id
+                while outer is not None:
+                    rematched = parent[outer]
+                    matches[inner] = outer
+                    matches[outer] = inner
+                    if rematched is None:
+                        break
+                    inner, outer = rematched, parent[rematched]
+                return True
+            parent[opponent.id] = player.id
+            mate = by_id[matches[opponent.id]]
+            if mate.id not in parent:
+                parent[mate.id] = opponent.id
+                queue.append(mate)
+    return False
+
+
+# Pair the players a partial matching left out.  Augmenting paths pair most
+# of them while changing only a few pairs already made.  Players with no
+# eligible opponent at all can never be paired, and are left out.  If anyone
+# else can't be reached by a path, it may be hidden in a blossom, and the
+# exact max weight matching, which pairs as many players as can be, is used
+def complete(bins, matches, unpaired):
+    players = [player for group in bins.values() for player in group]
+    by_id = dict((player.id, player) for player in players)
+    for player in unpaired:
+        if player.id in matches or augment(player, players, by_id, matches):
+            continue
+        if any(can_play(player, opponent)
+               for opponent in players if opponent is not player):
+            return blossom_matching(bins)
+    return matches
+
+
+# Add a stream of (player1, player2, weight) edges to a graph, writing each
+# straight into the graph's adjacency dictionaries.  Edges of equal weight
+# share one attribute dictionary, which max_weight_matching() only reads,
+# where add_weighted_edges_from() would make one per edge.  Both players must
+# already be nodes of the graph
+def add_weighted_edges(G, weighted_edges):
+    adj = G.adj
+    attrs = {}
+    for id1, id2, weight in weighted_edges:
+        data = attrs.get(weight)
+        if data is None:
+            data = attrs[weight] = {'weight': weight}
+        adj[id1][id2] = data
+        adj[id2][id1] = data
+
+
+# Exact pairing by max weight matching over the full weighted graph
+def blossom_matching(bins):
+    G = Graph()                                 # Construct graph
+    G.add_nodes_from(player.id for group in bins.values() for player in group)
+    add_weighted_edges(G, get_weighted_edges(bins))   # with weighted edges
     
-    return weighted_edges
+    # Determine matches using max weight matching algorithm
+    # maxcardinality = True to ensure every player is paired
+    return max_weight_matching(G, maxcardinality=True)
+
+
+# Cheap check that a full pairing with no rematches exists, to run before any
+# expensive weighted solve.  A greedy pass pairs most fields outright, and
+# augmenting paths finish nearly all the rest; a player with no eligible
+# opponent settles it the other way at once.  Only if neither does is the
+# exact matching run.  Returns the complete pairing found, which is the greedy
+# engine's pairing, or None if there is none
+def feasible_matching(bins):
+    matches = greedy_matching(bins)
+    if len(matches) < sum(len(group) for group in bins.values()):
+        return None
+    return matches
+
+
+# Rematch-free graph of the field as a dictionary of player id : set of ids of
+# players they may still be paired with
+def eligible_opponents(bins):
+    players = [player for group in bins.values() for player in group]
+    eligible = dict((player.id, set()) for player in players)
+    for i, player in enumerate(players):
+        for opponent in players[i+1:]:
+            if can_play(player, opponent):
+                eligible[player.id].add(opponent.id)
+                eligible[opponent.id].add(player.id)
+    return eligible
+
+
+# Take a round's player:opponent matches out of a rematch-free graph
+def remove_matches(eligible, matches):
+    for id, opponent in matches.items():
+        eligible[id].discard(opponent)
+
+
+# Return the ids of players a rematch-free graph can't pair in the coming
+# rounds once this round's matches are played, or an empty set if it can.
+# The graph is updated in place round by round: a player with fewer eligible
+# opponents left than rounds to play is stuck at once, otherwise a maximum
+# cardinality matching is taken out of the graph as that round's pairing.
+# Later rounds are paired one at a time, so a schedule that only exists by
+# choosing an earlier round differently can be missed, but each round costs
+# only a single matching
+def dead_ends(eligible, matches, rounds):
+    remove_matches(eligible, matches)
+    for round in range(rounds):
+        stuck = set(id for id, opponents in eligible.items()
+                    if len(opponents) < rounds - round)
+        if stuck:
+            return stuck
+        G = Graph()
+        G.add_nodes_from(eligible)
+        add_weighted_edges(G, ((id, opponent, 1) for id in eligible
+                               for opponent in eligible[id] if id < opponent))
+        future = max_weight_matching(G, maxcardinality=True)
+        if len(future) < len(eligible):
+            return set(eligible) - set(future)
+        remove_matches(eligible, future)
+    return set()
+
+
+# Rule out a pairing for the rest of this get_pairs() call, as though the
+# two players had already met
+def forbid(player, opponent):
+    player.played = list(player.played) + [opponent.id]
+    opponent.played = list(opponent.played) + [player.id]
+    if opponent.id == BYE:
+        player.had_bye = True
+    if player.id == BYE:
+        opponent.had_bye = True
+
+
+# Most pairings tried by lookahead before giving up on avoiding a dead end
+LOOKAHEAD_ATTEMPTS = 4
+
+
+# Check that this round's matches leave a rematch-free pairing for each of
+# the next rounds, and if not re-pair with the engine, ruling out the pairs
+# of the players who were left stranded, up to LOOKAHEAD_ATTEMPTS times.
+# The rematch-free graph is built once and copied for each check.  If every
+# attempt leads to a dead end, or ruling out more pairs would make this round
+# unpairable, the engine's first choice is kept
+def avoid_dead_ends(bins, matches, pair, rounds):
+    eligible = eligible_opponents(bins)
+    players = dict((player.id, player)
+                   for group in bins.values() for player in group)
+    candidate = matches
+    for attempt in range(LOOKAHEAD_ATTEMPTS):
+        remaining = dict((id, set(opponents))
+                         for id, opponents in eligible.items())
+        stuck = dead_ends(remaining, candidate, rounds)
+        if not stuck:
+            return candidate
+        stranded = [id for id in stuck if id in candidate]
+        if not stranded:
+            break
+        for id in stranded:
+            forbid(players[id], players[candidate[id]])
+        feasible = feasible_matching(bins)
+        if feasible is None:
+            break
+        candidate = feasible if pair is greedy_matching else pair(bins)
+    return matches
+
+
+# Copy of player_info with each player's oldest rounds of opponents dropped,
+# so those matches may be replayed.  Byes are never forgiven, so no one gets
+# a second one
+def forgive_oldest(player_info, rounds):
+    return [tuple(player[:5]) +
+            ([opponent for i, opponent in enumerate(player[5] or [])
+              if i >= rounds or opponent == BYE],) + tuple(player[6:])
+            for player in player_info]
 
 
-def get_pairs(player_info):
+# Policies for a round in which no pairing without rematches exists.
+# 'rematch' forgives the least recent round of opponents, then the next, until
+# a full pairing is possible, raising ValueError only if even forgiving every
+# round can't avoid a second bye; 'partial' leaves unpairable players out;
+# 'raise' raises ValueError
+INFEASIBLE_POLICIES = ('rematch', 'partial', 'raise')
+
+
+# Pairing engines selectable by name in get_pairs()
+ENGINES = OrderedDict([
+    ('blossom', blossom_matching),
+    ('greedy', greedy_matching),
+])
+
+
+# Turn from dictionary of player:opponent key:value pairs to list of
+# (id1, name1, id2, name2) tuples
+def matches_to_pairings(matches, players):
+    pairings = []
+    paired = set()          # Don't want to duplicate, so keep track of pairs
+    for k, v in matches.items():
+        if k in paired or v in paired:
+            continue
+        if k != BYE and v != BYE:
+            pairings.append((k, players[k].name, v, players[v].name))
+        elif k == BYE:
+            pairings.append((v, players[v].name, BYE, 'bye'))
+        elif v == BYE:
+            pairings.append((k, players[k].name, BYE, 'bye'))
+        paired.add(k)
+        paired.add(v)
+    
+    return pairings
+
+
+# Sum the edge weights of a list of pairings as get_weighted_edges() would
+# score them.  Pairs with no edge (rematches) count as None
+def pairing_weight(bins, pairings):
+    wanted = set(frozenset([pairing[0], pairing[2]]) for pairing in pairings)
+    weights = {}
+    for id1, id2, weight in get_weighted_edges(bins):
+        pair = frozenset([id1, id2])
+        if pair in wanted:
+            weights[pair] = weight
+    total = 0
+    for pairing in pairings:
+        weight = weights.get(frozenset([pairing[0], pairing[2]]))
+        if weight is None:
+            return None
+        total += weight
+    return total
+
+
+def get_pairs(player_info, engine='blossom', on_infeasible='rematch',
+              lookahead=0):
     """Return optimal pairings given list of player standings
 
     Args:
@@ -223,10 +576,27 @@ def get_pairs(player_info):
         opponents (int[]): list of opponent ids player has already played
         opp_pts (long): number of total points opponents have (3 win, 1 draw)
           (not used)
+      engine: name of the pairing engine in ENGINES.  'blossom' (default)
+        finds the max weight matching; 'greedy' is a near-linear Dutch-style
+        pass for very large fields that may give up some weight, but pairs
+        as many players as the exact matching does
+      on_infeasible: what to do when no pairing without rematches exists,
+        one of INFEASIBLE_POLICIES.  Default 'rematch' allows the least
+        recent rematches needed to pair everyone
+      lookahead: number of rounds still to be played after this one.  If
+        given, pairings that would leave no rematch-free pairing for one of
+        those rounds are avoided where a few re-pairings can manage it.
+        Meant for small events; with an even field and every remaining
+        round, it steers towards a complete round robin
         
     Returns:
       List of tuples of form (id1, name1, id2, name2) giving match pairs
     """
+    if engine not in ENGINES:
+        raise ValueError("Unknown pairing engine '{}'".format(engine))
+    if on_infeasible not in INFEASIBLE_POLICIES:
+        raise ValueError("Unknown infeasible round policy '{}'".format(
+            on_infeasible))
     
     # First check if any matches have been played.  If not, just pair evens
     # with odds
@@ -238,29 +608,70 @@ def get_pairs(player_info):
     players = create_player_dict(player_info)
     bins = construct_bins(players)
     
-    weighted_edges = get_weighted_edges(bins)   # Figure out edge weights
+    # Find out cheaply whether everyone can be paired before solving.  The
+    # pairing found doing so is the greedy engine's, so isn't worked out again
+    feasible = None
+    if on_infeasible != 'partial':
+        feasible = feasible_matching(bins)
+        if feasible is None and on_infeasible == 'raise':
+            raise ValueError("No pairing without rematches exists")
+        rounds = max(len(player[5] or []) for player in player_info)
+        forgiven = 0
+        while feasible is None:
+            forgiven += 1
+            if forgiven > rounds:
+                raise ValueError("No pairing without a second bye exists")
+            players = create_player_dict(
+                forgive_oldest(player_info, forgiven))
+            bins = construct_bins(players)
+            feasible = feasible_matching(bins)
     
-    G = Graph()                                 # Construct graph
-    G.add_weighted_edges_from(weighted_edges)   # using weighted edges
+    if feasible is not None and ENGINES[engine] is greedy_matching:
+        matches = feasible
+    else:
+        matches = ENGINES[engine](bins)
+    if lookahead:
+        matches = avoid_dead_ends(bins, matches, ENGINES[engine], lookahead)
     
-    # Determine matches using max weight matching algorithm
-    # maxcardinality = True to ensure every player is paired
-    matches = max_weight_matching(G, maxcardinality=True)
+    return matches_to_pairings(matches, players)
+
+
+def compare_engines(player_info, engine='greedy'):
+    """Compare a pairing engine against the exact max weight matching
+
+    Only practical on fields small enough for the exact matcher to run.
+
+    Args:
+      player_info: list of player tuples as taken by get_pairs()
+      engine: name of the engine to compare against 'blossom'
+        
+    Returns:
+      Dictionary with keys:
+        players (int): number of players in the field
+        exact_weight (int): total weight of the max weight matching
+        weight (int): total weight of the compared engine's pairings, or
+          None if it produced a rematch
+        unpaired (int): players the compared engine left unpaired
+        exact_seconds (float): time taken by the exact matcher
+        seconds (float): time taken by the compared engine
+    """
+    players = create_player_dict(player_info)
+    bins = construct_bins(players)
     
-    # Turn from dictionary of player:opponent key:value pairs to list of
-    # (id1, name1, id2, name2) tuples
-    pairings = []
-    paired = []             # Don't want to duplicate, so keep track of pairs
-    for k, v in matches.items():
-        if k in paired or v in paired:
-            continue
-        if k != BYE and v != BYE:
-            pairings.append((k, players[k].name, v, players[v].name))
-        elif k == BYE:
-            pairings.append((v, players[v].name, BYE, 'bye'))
-        elif v == BYE:
-            pairings.append((k, players[k].name, BYE, 'bye'))
-        paired.append(k)
-        paired.append(v)
+    start = time.time()
+    exact = matches_to_pairings(blossom_matching(bins), players)
+    exact_seconds = time.time() - start
     
-    return pairings
+    start = time.time()
+    pairings = matches_to_pairings(ENGINES[engine](bins), players)
+    seconds = time.time() - start
+    
+    num_players = sum(len(group) for group in bins.values())
+    return {
+        'players': len(player_info),
+        'exact_weight': pairing_weight(bins, exact),
+        'weight': pairing_weight(bins, pairings),
+        'unpaired': num_players - 2 * len(pairings),
+        'exact_seconds': exact_seconds,
+        'seconds': seconds,
+    }
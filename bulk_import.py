@@ -0,0 +1,203 @@
+#!/usr/bin/env python
+#
+# bulk_import.py -- bulk import of historical results from CSV files
+#
+# Registering players and reporting matches one call at a time opens a
+# connection per row.  This streams whole CSV files into temporary staging
+# tables with COPY, then resolves names to ids and inserts into players,
+# tournaments, tournament_players and matches set-wise in a few large
+# transactions.
+#
+# CSV files have a header row and these columns:
+#   players:  name
+#   entries:  tournament, player
+#   results:  tournament, winner, loser, draw
+# Players and tournaments are identified by name.  A name already in the
+# database refers to the existing player or tournament with the lowest id;
+# other names are registered.  A loser named 'bye' records a bye.  draw is
+# true for t, true, y, yes or 1 and false otherwise, including empty.
+#
+
+import argparse
+import os
+import sys
+import time
+
+from tournament import connect
+
+PROGRESS_EVERY = 1 << 20        # report progress every 1MB read
+
+
+class ProgressReader():
+    """File wrapper that reports how much of the file COPY has read."""
+
+    def __init__(self, f, stage, progress):
+        self.f = f
+        self.stage = stage
+        self.progress = progress
+        self.total = os.fstat(f.fileno()).st_size
+        self.done = 0
+        self.reported = 0
+
+    def read(self, size=-1):
+        data = self.f.read(size)
+        self.done += len(data)
+        if self.done - self.reported >= PROGRESS_EVERY or not data:
+            self.reported = self.done
+            self.progress(self.stage, self.done, self.total)
+        return data
+
+
+def _copy(cursor, path, table, columns, progress):
+    with open(path, 'rb') as f:
+        if progress is not None:
+            f = ProgressReader(f, table, progress)
+        cursor.copy_expert(
+            "COPY {} ({}) FROM STDIN WITH CSV HEADER;".format(
+                table, ', '.join(columns)), f)
+
+
+def _register_names(cursor):
+    """Register any new players and tournaments named in the staging tables
+    and build the name to id lookup tables.  Returns the number of players
+    and tournaments registered."""
+    cursor.execute("""INSERT INTO players (name)
+                      SELECT DISTINCT name FROM import_names AS n
+                      WHERE NOT EXISTS
+                          (SELECT 1 FROM players AS p WHERE p.name = n.name);
+                   """)
+    num_players = cursor.rowcount
+    cursor.execute("""INSERT INTO tournaments (name)
+                      SELECT DISTINCT name FROM import_tournament_names AS n
+                      WHERE NOT EXISTS
+                          (SELECT 1 FROM tournaments AS t
+                           WHERE t.name = n.name);
+                   """)
+    num_tournaments = cursor.rowcount
+    cursor.execute("""CREATE TEMP TABLE import_player_ids AS
+                          SELECT name, MIN(id) AS id FROM players
+                          WHERE name IN (SELECT name FROM import_names)
+                          GROUP BY name;
+                      CREATE UNIQUE INDEX ON import_player_ids (name);
+                      ANALYZE import_player_ids;
+                   """)
+    cursor.execute("""CREATE TEMP TABLE import_tournament_ids AS
+                          SELECT name, MIN(id) AS id FROM tournaments
+                          WHERE name IN
+                              (SELECT name FROM import_tournament_names)
+                          GROUP BY name;
+                      CREATE UNIQUE INDEX ON import_tournament_ids (name);
+                      ANALYZE import_tournament_ids;
+                   """)
+    return num_players, num_tournaments
+
+
+def import_csv(players=None, entries=None, results=None, progress=None):
+    """Import players, tournament entries and match results from CSV files.
+
+    Args:
+      players: path of the players CSV, or None
+      entries: path of the entries CSV, or None
+      results: path of the results CSV, or None
+      progress: optional function called as progress(stage, done, total)
+        with bytes read so far while each file is copied in
+
+    Returns:
+      Dictionary of rows inserted with keys 'players', 'tournaments',
+      'entries' and 'matches'
+    """
+    conn, cursor = connect()
+    counts = {}
+    # Pooled connections may still hold the tables from an earlier import
+    cursor.execute("""DROP TABLE IF EXISTS import_players, import_entries,
+                          import_results, import_names,
+                          import_tournament_names, import_player_ids,
+                          import_tournament_ids;
+                   """)
+    cursor.execute("""CREATE TEMP TABLE import_players (name TEXT);
+                      CREATE TEMP TABLE import_entries
+                          (tournament TEXT, player TEXT);
+                      CREATE TEMP TABLE import_results
+                          (seq BIGSERIAL, tournament TEXT, winner TEXT,
+                           loser TEXT, draw TEXT);
+                   """)
+    if players is not None:
+        _copy(cursor, players, 'import_players', ['name'], progress)
+    if entries is not None:
+        _copy(cursor, entries, 'import_entries', ['tournament', 'player'],
+              progress)
+    if results is not None:
+        _copy(cursor, results, 'import_results',
+              ['tournament', 'winner', 'loser', 'draw'], progress)
+
+    # Every name mentioned anywhere, so entries and results may name players
+    # missing from the players file
+    cursor.execute("""CREATE TEMP TABLE import_names AS
+                          SELECT name FROM import_players
+                          UNION SELECT player FROM import_entries
+                          UNION SELECT winner FROM import_results
+                          UNION SELECT loser FROM import_results;
+                      CREATE TEMP TABLE import_tournament_names AS
+                          SELECT tournament AS name FROM import_entries
+                          UNION SELECT tournament FROM import_results;
+                   """)
+    counts['players'], counts['tournaments'] = _register_names(cursor)
+    conn.commit()
+
+    # Tiebreaks are rebuilt once at the end rather than row by row
+    cursor.execute("SET LOCAL tournament.bulk_load = 'on';")
+    cursor.execute("""INSERT INTO tournament_players (tournament, player)
+                      SELECT DISTINCT t.id, p.id
+                      FROM import_entries AS e
+                      JOIN import_tournament_ids AS t ON e.tournament = t.name
+                      JOIN import_player_ids AS p ON e.player = p.name
+                      WHERE NOT EXISTS
+                          (SELECT 1 FROM tournament_players AS tp
+                           WHERE tp.tournament = t.id AND tp.player = p.id);
+                   """)
+    counts['entries'] = cursor.rowcount
+    conn.commit()
+
+    cursor.execute("SET LOCAL tournament.bulk_load = 'on';")
+    cursor.execute("""INSERT INTO matches (tournament, winner, loser, draw)
+                      SELECT t.id, w.id, l.id,
+                             COALESCE(lower(r.draw) IN
+                                      ('t', 'true', 'y', 'yes', '1'), FALSE)
+                      FROM import_results AS r
+                      JOIN import_tournament_ids AS t ON r.tournament = t.name
+                      JOIN import_player_ids AS w ON r.winner = w.name
+                      JOIN import_player_ids AS l ON r.loser = l.name
+                      ORDER BY r.seq;
+                   """)
+    counts['matches'] = cursor.rowcount
+    cursor.execute("""SELECT rebuild_player_scores(id)
+                      FROM import_tournament_ids;""")
+    conn.commit()
+    conn.close()
+    return counts
+
+
+def print_progress(stage, done, total):
+    sys.stderr.write('\r{}: {:.0%}'.format(stage, float(done) / (total or 1)))
+    if done >= total:
+        sys.stderr.write('\n')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Bulk import players, entries and results from CSV.')
+    parser.add_argument('--players', help='CSV of players: name')
+    parser.add_argument('--entries', help='CSV of entries: tournament, player')
+    parser.add_argument('--results',
+                        help='CSV of results: tournament, winner, loser, draw')
+    args = parser.parse_args()
+    start = time.time()
+    counts = import_csv(args.players, args.entries, args.results,
+                        print_progress)
+    seconds = time.time() - start
+    rows = sum(counts.values())
+    print '{} players, {} tournaments, {} entries, {} matches'.format(
+        counts['players'], counts['tournaments'], counts['entries'],
+        counts['matches'])
+    print '{} rows in {:.2f}s ({:.0f} rows/s)'.format(
+        rows, seconds, rows / seconds if seconds else 0)
@@ -0,0 +1,151 @@
+#!/usr/bin/env python
+#
+# generate_data.py -- fill the database with synthetic tournaments
+#
+# Slow queries usually only show up at a scale the tests never reach.  This
+# registers a pool of players and many tournaments, and plays each tournament
+# out round by round with get_pairs(), so every history is one the pairing
+# code could really have produced, with no rematches.  Draws happen at a set
+# rate and odd fields give a bye each round.  Everything is loaded with COPY,
+# a tournament at a time.
+#
+# The same seed and arguments give the same tournaments, whatever is already
+# in the database, so a slow query seen on generated data can be reproduced.
+#
+
+import argparse
+import random
+import sys
+import time
+from cStringIO import StringIO
+
+from benchmark import DRAW_RATE, simulate_tournament
+from binary_export import copy_rows
+from binning_and_graph_construction import BYE
+from tournament import connect
+
+FIRST_NAMES = (u'Ada', u'Boris', u'Chen', u'Dara', u'Emil', u'Fatima',
+               u'Gus', u'Hana', u'Ivan', u'Joy', u'Kofi', u'Lena', u'Mateo',
+               u'Nia', u'Omar', u'Priya', u'Quinn', u'Rosa', u'Sven', u'Tao',
+               u'Uma', u'Vera', u'Wren', u'Ximena', u'Yusuf', u'Zoe')
+LAST_NAMES = (u'Abara', u'Becker', u'Costa', u'Dubois', u'Eriksen',
+              u'Fischer', u'Garcia', u'Haddad', u'Ito', u'Jansen', u'Kowalski',
+              u'Larsen', u'Moreau', u'Nakamura', u'Okafor', u'Petrov',
+              u'Quispe', u'Rossi', u'Silva', u'Tanaka', u'Ueda', u'Varga',
+              u"O'Brien", u'Xu', u'Yilmaz', u'Zhang')
+
+
+def swiss_rounds(num_players):
+    """Return the usual number of Swiss rounds to find a single winner."""
+    rounds = 1
+    while 2 ** rounds < num_players:
+        rounds += 1
+    return rounds
+
+
+def _reserve_ids(cursor, sequence, count):
+    cursor.execute("SELECT nextval(%s) FROM generate_series(1, %s);",
+                   [sequence, count])
+    return [row[0] for row in cursor]
+
+
+def generate(tournaments=100, players=1000, min_field=8, max_field=64,
+             rounds=None, draw_rate=DRAW_RATE, engine='blossom', seed=0,
+             progress=None):
+    """Register synthetic players and tournaments and play them out.
+
+    Args:
+      tournaments: number of tournaments to generate
+      players: number of players in the pool tournaments draw from
+      min_field: fewest players in a tournament
+      max_field: most players in a tournament
+      rounds: rounds played by each tournament, default swiss_rounds() of
+        its field
+      draw_rate: chance of each match being drawn
+      engine: pairing engine, as taken by get_pairs()
+      seed: seed for field sizes, entries and results
+      progress: optional function called as progress(done, total) after
+        each tournament is loaded
+
+    Returns:
+      Dictionary of rows inserted with keys 'players', 'tournaments',
+      'entries' and 'matches', and of matches played with keys 'draws' and
+      'byes'
+    """
+    rng = random.Random(seed)
+    counts = {'players': players, 'tournaments': tournaments, 'entries': 0,
+              'matches': 0, 'draws': 0, 'byes': 0}
+    conn, cursor = connect()
+    player_ids = _reserve_ids(cursor, 'players_id_seq', players)
+    names = [u'{} {}'.format(rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES))
+             for id in player_ids]
+    cursor.copy_from(StringIO(copy_rows(zip(player_ids, names))), 'players',
+                     columns=('id', 'name'))
+    tournament_ids = _reserve_ids(cursor, 'tournaments_id_seq', tournaments)
+    cursor.copy_from(
+        StringIO(copy_rows((id, u'Synthetic {}'.format(number))
+                           for number, id in enumerate(tournament_ids, 1))),
+        'tournaments', columns=('id', 'name'))
+    conn.commit()
+
+    for done, tournament_id in enumerate(tournament_ids, 1):
+        size = rng.randint(min_field, min(max_field, players))
+        field = rng.sample(player_ids, size)
+        _, results = simulate_tournament(size, rounds or swiss_rounds(size),
+                                         rng, draw_rate, engine)
+        ids = dict(zip(range(BYE + 1, BYE + 1 + size), field))
+        ids[BYE] = BYE
+        # Scores are rebuilt once the tournament is in, not row by row
+        cursor.execute("SET LOCAL tournament.bulk_load = 'on';")
+        cursor.copy_from(
+            StringIO(copy_rows((tournament_id, id) for id in field)),
+            'tournament_players', columns=('tournament', 'player'))
+        cursor.copy_from(
+            StringIO(copy_rows(
+                (tournament_id, round, board, ids[winner], ids[loser], draw)
+                for round, board, winner, loser, draw in results)),
+            'matches',
+            columns=('tournament', 'round', 'board', 'winner', 'loser',
+                     'draw'))
+        cursor.execute("SELECT rebuild_player_scores(%s);", [tournament_id])
+        conn.commit()
+        counts['entries'] += size
+        counts['matches'] += len(results)
+        counts['draws'] += sum(1 for result in results if result[4])
+        counts['byes'] += sum(1 for result in results if result[3] == BYE)
+        if progress is not None:
+            progress(done, tournaments)
+    conn.close()
+    return counts
+
+
+def print_progress(done, total):
+    sys.stderr.write('\r{}/{} tournaments'.format(done, total))
+    if done >= total:
+        sys.stderr.write('\n')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Fill the database with synthetic tournaments.')
+    parser.add_argument('--tournaments', type=int, default=100)
+    parser.add_argument('--players', type=int, default=1000)
+    parser.add_argument('--min-field', type=int, default=8)
+    parser.add_argument('--max-field', type=int, default=64)
+    parser.add_argument('--rounds', type=int,
+                        help='rounds per tournament, default enough to find '
+                             'a single winner')
+    parser.add_argument('--draw-rate', type=float, default=DRAW_RATE)
+    parser.add_argument('--engine', default='blossom')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    start = time.time()
+    counts = generate(args.tournaments, args.players, args.min_field,
+                      args.max_field, args.rounds, args.draw_rate,
+                      args.engine, args.seed, print_progress)
+    seconds = time.time() - start
+    print '{} players, {} tournaments, {} entries, {} matches'.format(
+        counts['players'], counts['tournaments'], counts['entries'],
+        counts['matches'])
+    print '{} draws, {} byes, {:.2f}s'.format(counts['draws'], counts['byes'],
+                                              seconds)
@@ -0,0 +1,291 @@
+#!/usr/bin/env python
+#
+# journal.py -- append-only journal of tournament events with fast replay
+#
+# The database is the record of truth, but rebuilding pairing state from it
+# means running the whole standings query chain.  A journal keeps a binary log
+# of every roster change and match report for a tournament as it happens.  A
+# pairing worker keeps a TournamentState in memory, saves it as a snapshot
+# every so often, and after a restart loads the last snapshot and replays only
+# the journal written since.
+#
+# Journal file layout:
+#   header: 4 byte magic 'TJNL', 2 byte version
+#   records: kind (1 byte), id1 (4), id2 (4), draw (1), name length (2),
+#            followed by the utf-8 name for ENTER records
+# All integers are little-endian.
+#
+
+import cPickle
+import mmap
+import os
+import struct
+
+from binning_and_graph_construction import get_pairs
+
+MAGIC = 'TJNL'
+VERSION = 1
+SNAPSHOT_VERSION = 2
+HEADER = struct.Struct('<4sH')
+RECORD = struct.Struct('<BiiBH')
+
+# Record kinds
+ENTER = 1           # id1 entered into the tournament, with name
+REMOVE = 2          # id1 removed from the tournament
+MATCH = 3           # id1 beat id2, or drew with id2 if draw is set
+CLEAR = 4           # all matches in the tournament deleted
+
+
+class MatchJournal():
+    """Append-only binary journal of events in a single tournament.
+
+    Attributes:
+      path: path of the journal file
+    """
+
+    def __init__(self, path, sync=False):
+        """Open the journal at path, creating it if it doesn't exist.
+
+        Args:
+          path: path of the journal file
+          sync: whether to fsync after every record, so a record survives a
+            machine crash and not just a process crash
+        """
+        self.path = path
+        self.sync = sync
+        if not os.path.exists(path) or os.path.getsize(path) == 0:
+            with open(path, 'wb') as f:
+                f.write(HEADER.pack(MAGIC, VERSION))
+        else:
+            with open(path, 'rb') as f:
+                check_header(f.read(HEADER.size), path)
+        self._file = open(path, 'ab')
+
+    def _append(self, kind, id1, id2=0, draw=False, name=u''):
+        if isinstance(name, unicode):
+            name = name.encode('utf-8')
+        self._file.write(RECORD.pack(kind, id1, id2, draw, len(name)) + name)
+        self._file.flush()
+        if self.sync:
+            os.fsync(self._file.fileno())
+
+    def enterPlayer(self, player_id, name):
+        self._append(ENTER, player_id, name=name)
+
+    def removePlayer(self, player_id):
+        self._append(REMOVE, player_id)
+
+    def reportMatch(self, winner, loser, draw=False):
+        self._append(MATCH, winner, loser, draw)
+
+    def deleteMatches(self):
+        self._append(CLEAR, 0)
+
+    def close(self):
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def check_header(data, path):
+    """Raise ValueError unless data is a valid journal header."""
+    if len(data) < HEADER.size:
+        raise ValueError("{} is not a tournament journal".format(path))
+    magic, version = HEADER.unpack_from(data)
+    if magic != MAGIC:
+        raise ValueError("{} is not a tournament journal".format(path))
+    if version != VERSION:
+        raise ValueError("{} is journal version {}, expected {}".format(
+            path, version, VERSION))
+
+
+def replay(path, offset=0):
+    """Yield the records in a journal, starting at a byte offset.
+
+    The file is memory mapped rather than read, so replaying only the tail
+    of a long journal touches only the pages holding the tail.
+
+    Args:
+      path: path of the journal file
+      offset: byte offset of the first record to read, or 0 to start at the
+        first record
+
+    Yields:
+      (kind, id1, id2, draw, name, end) tuples, where end is the byte offset
+      just past the record, to resume from later
+    """
+    with open(path, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        if size == 0:
+            check_header('', path)
+        data = mmap.mmap(f.fileno(), size, access=mmap.ACCESS_READ)
+        try:
+            check_header(data[:HEADER.size], path)
+            offset = max(offset, HEADER.size)
+            while offset + RECORD.size <= size:
+                kind, id1, id2, draw, length = RECORD.unpack_from(data, offset)
+                end = offset + RECORD.size + length
+                if end > size:
+                    break           # record still being written
+                name = data[offset + RECORD.size:end].decode('utf-8')
+                yield kind, id1, id2, bool(draw), name, end
+                offset = end
+        finally:
+            data.close()
+
+
+class TournamentState():
+    """Compact in-memory standings and opponent sets for one tournament.
+
+    Attributes:
+      names: dictionary of player id : name for every entered player
+      records: dictionary of player id : [wins, draws, losses]
+      opponents: dictionary of player id : list of opponent ids, oldest first
+      results: dictionary of player id : list of results against each
+        opponent, 1 for a win, 0.5 for a draw and 0 for a loss
+      offset: journal byte offset up to which records have been applied
+    """
+
+    def __init__(self):
+        self.names = {}
+        self.records = {}
+        self.opponents = {}
+        self.results = {}
+        self.offset = 0
+
+    def apply(self, kind, id1, id2=0, draw=False, name=u''):
+        """Apply a single journal record to the state."""
+        if kind == ENTER:
+            self.names[id1] = name
+            self.records.setdefault(id1, [0, 0, 0])
+            self.opponents.setdefault(id1, [])
+            self.results.setdefault(id1, [])
+        elif kind == REMOVE:
+            self.names.pop(id1, None)
+        elif kind == MATCH:
+            for player, opponent in [(id1, id2), (id2, id1)]:
+                if player not in self.records:
+                    continue        # the bye, or a player never entered
+                if draw:
+                    self.records[player][1] += 1
+                    result = 0.5
+                elif player == id1:
+                    self.records[player][0] += 1
+                    result = 1
+                else:
+                    self.records[player][2] += 1
+                    result = 0
+                self.opponents[player].append(opponent)
+                self.results[player].append(result)
+        elif kind == CLEAR:
+            for id in self.records:
+                self.records[id] = [0, 0, 0]
+                self.opponents[id] = []
+                self.results[id] = []
+
+    def catchUp(self, path, snapshot_path=None, snapshot_every=None):
+        """Apply every journal record written since the last one applied.
+
+        Args:
+          path: path of the journal file
+          snapshot_path: where to save snapshots, if any
+          snapshot_every: save a snapshot after this many records
+
+        Returns:
+          int: number of records applied
+        """
+        applied = 0
+        for kind, id1, id2, draw, name, end in replay(path, self.offset):
+            self.apply(kind, id1, id2, draw, name)
+            self.offset = end
+            applied += 1
+            if snapshot_every and applied % snapshot_every == 0:
+                self.saveSnapshot(snapshot_path)
+        return applied
+
+    def saveSnapshot(self, path):
+        """Atomically write the state to path."""
+        tmp = path + '.tmp'
+        with open(tmp, 'wb') as f:
+            cPickle.dump((SNAPSHOT_VERSION, self.offset, self.names,
+                          self.records, self.opponents, self.results), f,
+                         cPickle.HIGHEST_PROTOCOL)
+        os.rename(tmp, path)
+
+    @classmethod
+    def loadSnapshot(cls, path):
+        """Return the state saved at path by saveSnapshot()."""
+        with open(path, 'rb') as f:
+            snapshot = cPickle.load(f)
+        if snapshot[0] != SNAPSHOT_VERSION:
+            raise ValueError("{} is snapshot version {}, expected {}".format(
+                path, snapshot[0], SNAPSHOT_VERSION))
+        version, offset, names, records, opponents, results = snapshot
+        state = cls()
+        state.offset = offset
+        state.names = names
+        state.records = records
+        state.opponents = opponents
+        state.results = results
+        return state
+
+    @classmethod
+    def recover(cls, path, snapshot_path=None):
+        """Rebuild state from the last snapshot, if any, and the journal.
+
+        Args:
+          path: path of the journal file
+          snapshot_path: path of the snapshot, which need not exist yet
+
+        Returns:
+          TournamentState up to date with the end of the journal
+        """
+        if snapshot_path is not None and os.path.exists(snapshot_path):
+            state = cls.loadSnapshot(snapshot_path)
+        else:
+            state = cls()
+        state.catchUp(path)
+        return state
+
+    def playerInfo(self):
+        """Return the players in standings order in the form get_pairs() takes.
+
+        Players are sorted by wins, then draws, then the tiebreaks buchholz,
+        Sonneborn-Berger and median Buchholz, as in
+        get_info_for_pairing_from_tourn(), and opponent points are their
+        buchholz.  As there, removed players still count as opponents, but
+        their points don't.
+        """
+        points = {}
+        for id in self.names:
+            wins, draws, losses = self.records[id]
+            points[id] = 3 * wins + draws
+        ranked = []
+        for id in self.names:
+            wins, draws, losses = self.records[id]
+            opponents = self.opponents[id]
+            # Byes and removed players score no points
+            games = [(points[o], result) for o, result
+                     in zip(opponents, self.results[id]) if o in points]
+            buchholz = sum(p for p, result in games)
+            sonneborn_berger = sum(p * result for p, result in games)
+            median_buchholz = buchholz
+            if len(games) >= 3:
+                median_buchholz -= (max(p for p, result in games) +
+                                    min(p for p, result in games))
+            ranked.append(((wins, draws, buchholz, sonneborn_berger,
+                            median_buchholz),
+                           (id, self.names[id], wins, draws, losses,
+                            list(opponents), buchholz)))
+        ranked.sort(key=lambda p: p[0], reverse=True)
+        return [p[1] for p in ranked]
+
+    def swissPairings(self, engine='blossom', on_infeasible='rematch',
+                      lookahead=0):
+        """Return pairings for the next round, as in
+        Tournament.swissPairings()."""
+        return get_pairs(self.playerInfo(), engine, on_infeasible, lookahead)
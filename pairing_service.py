@@ -0,0 +1,221 @@
+#!/usr/bin/env python
+#
+# pairing_service.py -- resident pairing service over a Unix or TCP socket
+#
+# Every script that calls swissPairings() pays for importing networkx, a new
+# database connection and rebuilding all pairing state from the standings
+# queries.  This service does that once: it imports the solver at start up and
+# keeps a TournamentState for each tournament it has seen warm in memory,
+# updating it as reports come in through the service.
+#
+# Requests and responses are single lines of JSON.  Each request has an 'op'
+# and a 'tournament' id:
+#   {"op": "enter", "tournament": 2, "player": 5}
+#   {"op": "remove", "tournament": 2, "player": 5}
+#   {"op": "report", "tournament": 2, "winner": 5, "loser": 6,
+#    "draw": false, "round": 1, "board": 3}
+#   {"op": "standings", "tournament": 2}
+#   {"op": "pair", "tournament": 2, "engine": "blossom",
+#    "on_infeasible": "rematch", "lookahead": 0}
+#   {"op": "reload", "tournament": 2}
+# draw, round, board, engine, on_infeasible and lookahead are optional.
+# Responses are {"ok": true, "result": ...} or {"ok": false, "error": "..."}.
+#
+# Changes made to a tournament other than through the service aren't seen
+# until it is reloaded.  Requests for different tournaments run in parallel.
+#
+
+import argparse
+import json
+import os
+import socket
+import threading
+from SocketServer import (StreamRequestHandler, ThreadingTCPServer,
+                          ThreadingUnixStreamServer)
+
+# Importing journal imports the solver, once, at start up
+from journal import MATCH, REMOVE, TournamentState
+from tournament import Tournament, connect
+
+
+def load_state(tournament_id):
+    """Build a TournamentState for a tournament from the database."""
+    conn, cursor = connect()
+    query = """SELECT * FROM get_info_for_pairing_from_tourn(%s);"""
+    cursor.execute(query, [tournament_id])
+    state = TournamentState()
+    for id, name, wins, draws, losses, opponents, points in cursor:
+        state.names[id] = name
+        state.records[id] = [wins, draws, losses]
+        state.opponents[id] = []
+        state.results[id] = []
+    # Each player's games, oldest first, as in the opponents arrays
+    query = """SELECT id, CASE WHEN winner = id THEN loser ELSE winner END,
+                      CASE WHEN draw THEN 0.5 WHEN winner = id THEN 1
+                           ELSE 0 END
+               FROM get_matches_from_tourn(%s)
+               WHERE match_id IS NOT NULL
+               ORDER BY match_id;"""
+    cursor.execute(query, [tournament_id])
+    for id, opponent, result in cursor:
+        state.opponents[id].append(opponent)
+        state.results[id].append(float(result))
+    conn.close()
+    return state
+
+
+class PairingService():
+    """Warm per-tournament pairing state, shared by all request handlers."""
+
+    def __init__(self):
+        self._states = {}
+        self._locks = {}
+        self._lock = threading.Lock()
+
+    def _tournament_lock(self, tournament_id):
+        with self._lock:
+            if tournament_id not in self._locks:
+                self._locks[tournament_id] = threading.Lock()
+            return self._locks[tournament_id]
+
+    def _state(self, tournament_id):
+        if tournament_id not in self._states:
+            self._states[tournament_id] = load_state(tournament_id)
+        return self._states[tournament_id]
+
+    def handle(self, request):
+        """Carry out one request and return its result."""
+        op = request['op']
+        tournament_id = request['tournament']
+        with self._tournament_lock(tournament_id):
+            t = Tournament(None, tournament_id)
+            if op == 'enter':
+                t.enterPlayer(request['player'])
+            if op in ['enter', 'reload']:
+                # State is rebuilt on next use, picking up the player's name
+                self._states.pop(tournament_id, None)
+                return None
+            state = self._state(tournament_id)
+            if op == 'remove':
+                t.removePlayer(request['player'])
+                state.apply(REMOVE, request['player'])
+                return None
+            if op == 'report':
+                draw = request.get('draw', False)
+                recorded = t.reportMatch(request['winner'], request['loser'],
+                                         draw, request.get('round'),
+                                         request.get('board'))
+                if recorded:
+                    state.apply(MATCH, request['winner'], request['loser'],
+                                draw)
+                return recorded
+            if op == 'standings':
+                return [p[:5] for p in state.playerInfo()]
+            if op == 'pair':
+                return state.swissPairings(
+                    request.get('engine', 'blossom'),
+                    request.get('on_infeasible', 'rematch'),
+                    request.get('lookahead', 0))
+        raise ValueError("Unknown op '{}'".format(op))
+
+
+class RequestHandler(StreamRequestHandler):
+    """Reads JSON requests a line at a time and writes a JSON line back."""
+
+    def handle(self):
+        for line in iter(self.rfile.readline, ''):
+            try:
+                result = self.server.service.handle(json.loads(line))
+                response = {'ok': True, 'result': result}
+            except Exception as e:
+                response = {'ok': False, 'error': str(e)}
+            self.wfile.write(json.dumps(response) + '\n')
+            self.wfile.flush()
+
+
+class UnixPairingServer(ThreadingUnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, path, service):
+        if os.path.exists(path):
+            os.remove(path)
+        ThreadingUnixStreamServer.__init__(self, path, RequestHandler)
+        self.service = service
+
+
+class TCPPairingServer(ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address, service):
+        ThreadingTCPServer.__init__(self, address, RequestHandler)
+        self.service = service
+
+
+class PairingClient():
+    """Client for a running pairing service.
+
+    Each method sends one request and returns its result, raising
+    ValueError if the service reports an error.
+    """
+
+    def __init__(self, path=None, address=None):
+        """Connect to the service's Unix socket path or (host, port)."""
+        if path is not None:
+            self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self.sock.connect(path)
+        else:
+            self.sock = socket.create_connection(address)
+        self.file = self.sock.makefile('rwb')
+
+    def request(self, op, tournament_id, **kwargs):
+        kwargs.update(op=op, tournament=tournament_id)
+        self.file.write(json.dumps(kwargs) + '\n')
+        self.file.flush()
+        response = json.loads(self.file.readline())
+        if not response['ok']:
+            raise ValueError(response['error'])
+        return response['result']
+
+    def enterPlayer(self, tournament_id, player_id):
+        return self.request('enter', tournament_id, player=player_id)
+
+    def removePlayer(self, tournament_id, player_id):
+        return self.request('remove', tournament_id, player=player_id)
+
+    def reportMatch(self, tournament_id, winner, loser, draw=False,
+                    round=None, board=None):
+        return self.request('report', tournament_id, winner=winner,
+                            loser=loser, draw=draw, round=round, board=board)
+
+    def playerStandings(self, tournament_id):
+        return [tuple(p) for p in self.request('standings', tournament_id)]
+
+    def swissPairings(self, tournament_id, engine='blossom',
+                      on_infeasible='rematch', lookahead=0):
+        return [tuple(p) for p in self.request(
+            'pair', tournament_id, engine=engine,
+            on_infeasible=on_infeasible, lookahead=lookahead)]
+
+    def reload(self, tournament_id):
+        return self.request('reload', tournament_id)
+
+    def close(self):
+        self.file.close()
+        self.sock.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Serve pairings from warm in-memory tournament state.')
+    group = parser.add_mutually_exclusive_group(required=True)
+    group.add_argument('--socket', help='path of the Unix socket to listen on')
+    group.add_argument('--port', type=int, help='TCP port to listen on')
+    parser.add_argument('--host', default='127.0.0.1')
+    args = parser.parse_args()
+    service = PairingService()
+    if args.socket is not None:
+        server = UnixPairingServer(args.socket, service)
+    else:
+        server = TCPPairingServer((args.host, args.port), service)
+    server.serve_forever()
@@ -0,0 +1,163 @@
+#!/usr/bin/env python
+#
+# projection.py -- Monte Carlo projection of final standings
+#
+# Answers "what are my chances of making the top 8?" by playing out the rest
+# of an event many times over.  Rather than running get_pairs() and recording
+# results one simulation at a time, every simulation's standings are a row of
+# a NumPy array and each round is played across all rows at once: players are
+# ranked by points, with ties broken at random, and paired with the next
+# player down, which is close to Swiss pairing but ignores rematches.  With an
+# odd number of players, the lowest ranked player yet to have a bye gets one.
+# Results are drawn for every board of every simulation together.  Final
+# places are by wins, then draws, then opponent points, then id, highest
+# first, as in playerStandings().
+#
+# Simulations are split into chunks run on a pool of processes, each chunk
+# seeded from the seed given, so a projection can be repeated exactly.
+#
+# NumPy is needed for projections but not by the rest of the package.
+#
+
+from multiprocessing import Pool, cpu_count
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from benchmark import DRAW_RATE
+from binning_and_graph_construction import BYE
+
+CHUNK = 500             # simulations played out at once in a worker
+
+
+def _simulate_chunk(ids, wins, draws, had_bye, past_opponents, rounds,
+                    simulations, draw_rate, seed):
+    # Play out the remaining rounds of one chunk of simulations, returning
+    # counts[player, place] of how often each player finished in each place
+    rng = np.random.RandomState(seed)
+    n = len(wins)
+    rows = np.arange(simulations)[:, None]
+    wins = np.tile(wins, (simulations, 1))
+    draws = np.tile(draws, (simulations, 1))
+    had_bye = np.tile(had_bye, (simulations, 1))
+    # -1 is a bye, or no one, and indexes the zero column added at the end
+    opponents = np.full((simulations, n, rounds), -1, dtype=np.int64)
+    for round in range(rounds):
+        points = 3 * wins + draws
+        jitter = rng.random_sample(points.shape)
+        order = np.argsort(-(points + jitter), axis=1)
+        if n % 2:
+            # The last place in order whose player hasn't had a bye, or the
+            # last place if everyone has
+            eligible = ~had_bye[rows, order]
+            last = n - 1 - np.argmax(eligible[:, ::-1], axis=1)
+            last[~eligible.any(axis=1)] = n - 1
+            bye = order[rows[:, 0], last]
+            wins[rows[:, 0], bye] += 1
+            had_bye[rows[:, 0], bye] = True
+            paired = np.ones(order.shape, dtype=bool)
+            paired[rows[:, 0], last] = False
+            order = order[paired].reshape(simulations, n - 1)
+        first, second = order[:, 0::2], order[:, 1::2]
+        result = rng.random_sample(first.shape)
+        draw = result < draw_rate
+        first_wins = ~draw & (result < (1 + draw_rate) / 2)
+        second_wins = ~draw & ~first_wins
+        wins[rows, first] += first_wins
+        wins[rows, second] += second_wins
+        draws[rows, first] += draw
+        draws[rows, second] += draw
+        opponents[rows, first, round] = second
+        opponents[rows, second, round] = first
+
+    points = 3 * wins + draws
+    padded = np.concatenate(
+        [points, np.zeros((simulations, 1), dtype=points.dtype)], axis=1)
+    opp_points = (padded[rows[:, :, None], opponents].sum(axis=2) +
+                  padded[:, past_opponents].sum(axis=2))
+    order = np.lexsort((-np.tile(ids, (simulations, 1)), -opp_points,
+                        -draws, -wins), axis=1)
+    places = np.empty_like(order)
+    places[rows, order] = np.arange(n)
+    return np.bincount((np.arange(n) * n + places).ravel(),
+                       minlength=n * n).reshape(n, n)
+
+
+# Each worker gets one task of many chunks and sends back a single count
+# array, as the arrays are large beside the work done for each chunk
+def _simulate(args):
+    ids, wins, draws, had_bye, past_opponents, rounds, chunks, draw_rate = args
+    counts = 0
+    for simulations, seed in chunks:
+        counts = counts + _simulate_chunk(ids, wins, draws, had_bye,
+                                          past_opponents, rounds,
+                                          simulations, draw_rate, seed)
+    return counts
+
+
+def project_standings(player_info, rounds, simulations=10000, top=8,
+                      processes=None, draw_rate=DRAW_RATE, seed=0):
+    """Project final standings by simulating the remaining rounds.
+
+    Every match is taken to be an even contest, drawn with chance
+    draw_rate.
+
+    Args:
+      player_info: list of player tuples in standings order, as taken by
+        get_pairs()
+      rounds: number of rounds left to play
+      simulations: number of times to play out the remaining rounds
+      top: size of the top cut whose odds are reported
+      processes: number of worker processes, default the number of CPUs
+      draw_rate: chance of each simulated match being drawn
+      seed: seed for the simulated results
+
+    Returns:
+      A list of tuples in the order of player_info, each of which contains
+      (id, name, top_odds, mean_place, places):
+        id: the player's id
+        name: the player's name
+        top_odds: chance of finishing in the top places
+        mean_place: expected final place, first place being 1
+        places: NumPy array of the chance of finishing in each place, first
+          place first
+    """
+    if np is None:
+        raise ImportError("project_standings() needs NumPy")
+    index = dict((player[0], i) for i, player in enumerate(player_info))
+    n = len(player_info)
+    ids = np.array([player[0] for player in player_info], dtype=np.int64)
+    wins = np.array([player[2] for player in player_info], dtype=np.int64)
+    draws = np.array([player[3] for player in player_info], dtype=np.int64)
+    had_bye = np.array([BYE in (player[5] or []) for player in player_info])
+    past = [[index[o] for o in player[5] or [] if o in index and o != BYE]
+            for player in player_info]
+    past_opponents = np.full((n, max([len(p) for p in past] + [1])), -1,
+                             dtype=np.int64)
+    for i, opponents in enumerate(past):
+        past_opponents[i, :len(opponents)] = opponents
+
+    # Chunks are seeded in order, so the projection doesn't depend on how
+    # many processes share them
+    chunks = [(min(CHUNK, simulations - start), seed + chunk)
+              for chunk, start in enumerate(range(0, simulations, CHUNK))]
+    processes = min(processes or cpu_count(), len(chunks))
+    tasks = [(ids, wins, draws, had_bye, past_opponents, rounds,
+              chunks[i::processes], draw_rate) for i in range(processes)]
+    pool = Pool(processes)
+    try:
+        counts = sum(pool.map(_simulate, tasks))
+    finally:
+        pool.close()
+        pool.join()
+
+    distribution = counts / float(simulations)
+    place_numbers = np.arange(1, n + 1)
+    projection = []
+    for i, player in enumerate(player_info):
+        places = distribution[i]
+        projection.append((player[0], player[1], places[:top].sum(),
+                           (places * place_numbers).sum(), places))
+    return projection
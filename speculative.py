@@ -0,0 +1,181 @@
+#!/usr/bin/env python
+#
+# speculative.py -- pair the next round while the last boards are still playing
+#
+# Round turnover normally waits for the final result before pairing starts.
+# A SpeculativeRound follows the boards of the current round as they are
+# reported.  Once few enough are left that every combination of their results
+# (a win, draw or loss on each, so 3^k for k boards) can be covered, it pairs
+# the next round for all of them at once on a pool of processes.  When the
+# last result comes in, the pairings for what actually happened are already
+# waiting.
+#
+# Each combination is applied to the standings in memory, as TournamentState
+# holds them, and players are ranked by the same tiebreaks as in the
+# database, though players level on all of them may be ordered differently.
+# Results reported other than through the SpeculativeRound aren't seen until
+# the next round.
+#
+
+from itertools import product
+from multiprocessing import Pool
+
+from binning_and_graph_construction import BYE, get_pairs
+from journal import MATCH
+from pairing_service import load_state
+
+MAX_SPECULATIONS = 243      # most combinations paired ahead, 3^5
+
+# Results of a board, for the first player on it
+WIN, DRAW, LOSS = 'win', 'draw', 'loss'
+OUTCOMES = (WIN, DRAW, LOSS)
+
+
+def apply_outcome(state, board, outcome):
+    """Apply the result of a board to a TournamentState."""
+    player1, player2 = board
+    if outcome == WIN:
+        state.apply(MATCH, player1, player2)
+    elif outcome == LOSS:
+        state.apply(MATCH, player2, player1)
+    else:
+        state.apply(MATCH, player1, player2, True)
+
+
+# Runs in a pairing process, on its own copy of the state
+def _pair_outcomes(state, boards, outcomes, engine, on_infeasible,
+                   lookahead):
+    for board, outcome in zip(boards, outcomes):
+        apply_outcome(state, board, outcome)
+    return get_pairs(state.playerInfo(), engine, on_infeasible, lookahead)
+
+
+class SpeculativeRound():
+    """A round in play whose next round is paired ahead of time.
+
+    Attributes:
+      tournament: Tournament the round belongs to
+      boards: list of (player1, player2) for each board, board 1 first
+      round: round number results are reported under, if any
+      results: dictionary of board index : outcome for each board reported
+      speculated: number of outcome combinations being paired ahead
+    """
+
+    def __init__(self, tournament, pairings, round=None, engine='blossom',
+                 on_infeasible='rematch', lookahead=0, processes=None,
+                 max_speculations=MAX_SPECULATIONS):
+        """Start following a round.
+
+        Args:
+          tournament: Tournament the round belongs to
+          pairings: the round's pairings, as returned by swissPairings()
+          round: round number to report results under, or None
+          engine: pairing engine for the next round
+          on_infeasible: policy for the next round, as in get_pairs()
+          lookahead: rounds to look ahead pairing the next round, as in
+            get_pairs()
+          processes: number of pairing processes, default the number of CPUs
+          max_speculations: most outcome combinations to pair ahead.  With
+            more boards than that allows still to play, nothing is paired
+            until enough are reported
+        """
+        self.tournament = tournament
+        self.boards = [(p[0], p[2]) for p in pairings]
+        self.round = round
+        self.engine = engine
+        self.on_infeasible = on_infeasible
+        self.lookahead = lookahead
+        self.max_speculations = max_speculations
+        self.results = {}
+        self.speculated = 0
+        self._processes = processes
+        self._pool = None
+        self._speculative_boards = None
+        self._cache = {}
+
+    def _board(self, player1, player2):
+        for index, board in enumerate(self.boards):
+            if board == (player1, player2):
+                return index, False
+            if board == (player2, player1):
+                return index, True
+        raise ValueError("Players {} and {} aren't paired this round".format(
+            player1, player2))
+
+    def pending(self):
+        """Return the indexes of the boards not yet reported."""
+        return [index for index in range(len(self.boards))
+                if index not in self.results]
+
+    def reportMatch(self, winner, loser, draw=False):
+        """Report the result of a board, as Tournament.reportMatch().
+
+        Once few enough boards are left, starts pairing the next round for
+        every combination of their results.
+
+        Returns:
+          True if the result was recorded, False if already reported
+        """
+        index, swapped = self._board(winner, loser)
+        recorded = self.tournament.reportMatch(winner, loser, draw,
+                                               self.round, index + 1)
+        if draw:
+            self.results[index] = DRAW
+        else:
+            self.results[index] = LOSS if swapped else WIN
+        self._speculate()
+        return recorded
+
+    def _speculate(self):
+        # Byes have only one result, so are never speculated on
+        byes = [index for index in self.pending()
+                if self.boards[index][1] == BYE]
+        pending = [index for index in self.pending() if index not in byes]
+        if (self._speculative_boards is not None or not pending or
+                len(OUTCOMES) ** len(pending) > self.max_speculations):
+            return
+        # Results reported so far are in the database
+        state = load_state(self.tournament.id)
+        for index in byes:
+            apply_outcome(state, self.boards[index], WIN)
+        boards = [self.boards[index] for index in pending]
+        self._pool = Pool(self._processes)
+        for outcomes in product(OUTCOMES, repeat=len(pending)):
+            self._cache[outcomes] = self._pool.apply_async(
+                _pair_outcomes, (state, boards, outcomes, self.engine,
+                                 self.on_infeasible, self.lookahead))
+        self._pool.close()
+        self._speculative_boards = pending
+        self.speculated = len(self._cache)
+
+    def nextPairings(self, wait=False):
+        """Return the next round's pairings once every board is reported.
+
+        If the pairings for the actual results have been worked out ahead,
+        they're returned at once.  If they weren't speculated on, or are
+        still being worked out and wait is false, the next round is paired
+        from the database as Tournament.swissPairings() would.
+
+        Args:
+          wait: wait for pairings still being worked out ahead
+        """
+        if self.pending():
+            raise ValueError("Boards {} haven't been reported".format(
+                [index + 1 for index in self.pending()]))
+        if self._speculative_boards is not None:
+            outcomes = tuple(self.results[index]
+                             for index in self._speculative_boards)
+            result = self._cache[outcomes]
+            if wait:
+                result.wait()
+            if result.ready() and result.successful():
+                return result.get()
+        return self.tournament.swissPairings(self.engine, self.on_infeasible,
+                                             self.lookahead)
+
+    def close(self):
+        """Stop any pairing still in progress."""
+        if self._pool is not None:
+            self._pool.terminate()
+            self._pool.join()
+            self._pool = None
@@ -3,40 +3,286 @@
 # tournament.py -- implementation of a Swiss-system tournament
 #
 
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from cStringIO import StringIO
+
 import psycopg2
-from binning_and_graph_construction import get_pairs
+import psycopg2.extensions
+from binary_export import TournamentExport, copy_rows, write_export
 
 BYE = 1         # player id for bye is 1
+LOCK_NAMESPACE = 7370   # first key of each tournament's advisory lock
+POOL_SIZE = 4           # idle connections kept open per database, 0 for none
+PREPARE = True          # run hot queries as prepared statements
+
+# Connection targets.  Writes, and anything run under an advisory lock, go to
+# the primary; queries that only read go to the replica, if there is one
+PRIMARY_DSN = os.environ.get('TOURNAMENT_DSN', 'dbname=tournament')
+REPLICA_DSN = os.environ.get('TOURNAMENT_REPLICA_DSN')
+
+# Schema migrations, oldest first: running MIGRATIONS[n - 1] brings the schema
+# to version n.  tournament.sql sets up version 1 in an empty database, and
+# each later change to the schema is a new file added to the end
+MIGRATIONS = ['tournament.sql']
+SCHEMA_DIR = os.path.dirname(os.path.abspath(__file__))
+SCHEMA_LOCK = 0         # second key of the advisory lock held while migrating
+
+# Hot queries, run through executePrepared()
+STATEMENTS = {
+    'count_players': """SELECT COUNT(*) AS num FROM players WHERE id <> 1;""",
+    'count_tournament_players': """SELECT COUNT(*) AS num
+                                   FROM tournament_players
+                                   WHERE tournament = %s;""",
+    'standings': """SELECT id, name, wins, draws, losses
+                    FROM get_ranked_standings_from_tourn(%s)
+                    ORDER BY wins DESC, draws DESC, points DESC, id DESC;""",
+    'pairing_info': """SELECT * FROM get_info_for_pairing_from_tourn(%s);""",
+    'report_match': """INSERT INTO matches
+                           (tournament, round, board, winner, loser, draw)
+                       VALUES (%s, %s, %s, %s, %s, %s)
+                       ON CONFLICT (tournament, round, board) DO NOTHING
+                       RETURNING id;""",
+}
+
+_pools = {}             # dsn : list of idle connections
+_pool_lock = threading.Lock()
+
+# WAL location of each thread's last write through the functions below, which
+# that thread's later reads wait for (see _read())
+_session = threading.local()
 
 
-def connect(dbname='tournament'):
-    """Connect to the PostgreSQL database, returning a connection and cursor."""
-    try:
-        conn = psycopg2.connect("dbname={}".format(dbname))
-    except psycopg2.OperationalError, e:
-        print e
-        return None, None
+class TournamentConnection(psycopg2.extensions.connection):
+    """Connection that knows which statements it has prepared.
+    
+    Connections handed out by connect() are pooled: close() rolls back and
+    returns them to the pool, up to POOL_SIZE per DSN, so statements
+    prepared on them are reused by later calls.
+    """
+    
+    def __init__(self, *args, **kwargs):
+        super(TournamentConnection, self).__init__(*args, **kwargs)
+        self.prepared = set()
+        self.pool_key = None
+    
+    def close(self):
+        if self.pool_key is not None and not self.closed:
+            self.rollback()
+            with _pool_lock:
+                idle = _pools.setdefault(self.pool_key, [])
+                if len(idle) < POOL_SIZE:
+                    idle.append(self)
+                    return
+        super(TournamentConnection, self).close()
+
+
+def connect(dbname=None, read=False, after=None):
+    """Connect to the PostgreSQL database, returning a connection and cursor.
+    
+    Connections are made to PRIMARY_DSN, or to the database named by dbname.
+    Queries that only read pass read=True, and are sent to REPLICA_DSN when
+    one is configured.  If the replica can't be reached, or after is given
+    and the replica hasn't yet replayed the primary's WAL that far, the
+    primary is used instead, once.
+    
+    Args:
+      dbname: name of a database to connect to instead of PRIMARY_DSN
+      read: whether only reads will be run on the connection
+      after: WAL location, as pg_current_wal_lsn() gave on the primary, that
+        reads must see
+    
+    Raises:
+      psycopg2.OperationalError: the primary, or the database named by
+        dbname, can't be reached
+    """
+    if dbname is not None:
+        dsn = "dbname={}".format(dbname)
+    elif read and REPLICA_DSN:
+        dsn = REPLICA_DSN
+    else:
+        dsn = PRIMARY_DSN
+    replica = dbname is None and read and dsn == REPLICA_DSN
+    conn = None
+    with _pool_lock:
+        idle = _pools.get(dsn)
+        if idle:
+            conn = idle.pop()
+    if conn is None:
+        try:
+            conn = psycopg2.connect(dsn,
+                                    connection_factory=TournamentConnection)
+        except psycopg2.OperationalError, e:
+            if not replica:
+                raise
+            print e
+            return connect()
+        if POOL_SIZE > 0:
+            conn.pool_key = dsn
     cursor = conn.cursor()
+    if replica and after is not None:
+        # NULL if the server isn't replaying WAL at all
+        cursor.execute("SELECT pg_last_wal_replay_lsn() >= %s::pg_lsn;",
+                       [after])
+        if not cursor.fetchone()[0]:
+            conn.close()
+            return connect()
     return conn, cursor
+
+
+def configure(primary=None, replica=None):
+    """Set the connection targets used by connect().
+    
+    Idle pooled connections to the old targets are closed.
+    
+    Args:
+      primary: libpq connection string for writes, default the
+        TOURNAMENT_DSN environment variable or "dbname=tournament"
+      replica: libpq connection string for reads, or None to send reads to
+        the primary too
+    """
+    global PRIMARY_DSN, REPLICA_DSN
+    PRIMARY_DSN = primary or os.environ.get('TOURNAMENT_DSN',
+                                            'dbname=tournament')
+    REPLICA_DSN = replica
+    closePool()
+
+
+def currentLSN(cursor):
+    """Return the primary's current WAL location, for connect(after=...)."""
+    cursor.execute("SELECT pg_current_wal_lsn()::text;")
+    return cursor.fetchone()[0]
+
+
+def _latestLSN(*lsns):
+    """Return the latest of some WAL locations, ignoring any that are None."""
+    lsns = [lsn for lsn in lsns if lsn is not None]
+    if not lsns:
+        return None
+    return max(lsns, key=lambda lsn: [int(part, 16)
+                                      for part in lsn.split('/')])
+
+
+def _read():
+    """Connect for reads that must see this thread's own writes.
+    
+    Module-level functions always read their own writes: once one of them
+    has written, reads by the same thread go to the primary until the
+    replica has caught up.
+    """
+    return connect(read=True, after=getattr(_session, 'written_lsn', None))
+
+
+def _wrote(cursor):
+    """Note the WAL location of a write just committed on cursor."""
+    if REPLICA_DSN:
+        _session.written_lsn = currentLSN(cursor)
+
+
+def closePool():
+    """Close every idle pooled connection."""
+    with _pool_lock:
+        idle = [conn for conns in _pools.values() for conn in conns]
+        _pools.clear()
+    for conn in idle:
+        conn.pool_key = None
+        conn.close()
+
+
+def executePrepared(cursor, name, args=()):
+    """Run one of the STATEMENTS, preparing it first if need be.
+    
+    Each statement is prepared at most once per connection, so on a pooled
+    connection PostgreSQL parses and plans it only once.  With PREPARE off,
+    or on a connection not from connect(), the query is run as plain SQL.
+    """
+    conn = cursor.connection
+    if not PREPARE or not isinstance(conn, TournamentConnection):
+        cursor.execute(STATEMENTS[name], args)
+        return
+    if name not in conn.prepared:
+        params = iter(range(1, len(args) + 1))
+        query = re.sub('%s', lambda m: '${}'.format(next(params)),
+                       STATEMENTS[name])
+        cursor.execute("PREPARE {} AS {}".format(name, query))
+        conn.prepared.add(name)
+    if args:
+        cursor.execute("EXECUTE {} ({});".format(
+            name, ', '.join(['%s'] * len(args))), args)
+    else:
+        cursor.execute("EXECUTE {};".format(name))
+    
     
+def schemaVersion(cursor):
+    """Return the version of the database schema, 0 if it isn't set up."""
+    cursor.execute("SELECT to_regclass('schema_version') IS NOT NULL;")
+    if not cursor.fetchone()[0]:
+        return 0
+    cursor.execute("SELECT version FROM schema_version;")
+    return cursor.fetchone()[0]
+
+
+def migrate(cursor):
+    """Bring the database schema up to date by running pending MIGRATIONS.
+    
+    Each migration's DDL is read and run once per database, in the caller's
+    transaction, under an advisory lock so two callers can't both run it.
+    A database set up before the schema was versioned needs clearAll().
     
+    Returns:
+      int: number of migrations run
+    """
+    cursor.execute("SELECT pg_advisory_xact_lock(%s, %s);",
+                   [LOCK_NAMESPACE, SCHEMA_LOCK])
+    version = schemaVersion(cursor)
+    pending = MIGRATIONS[version:]
+    for number, path in enumerate(pending, version + 1):
+        cursor.execute(open(os.path.join(SCHEMA_DIR, path), "r").read())
+        cursor.execute("UPDATE schema_version SET version = %s;", [number])
+    return len(pending)
+
+
 def clearAll():
-    """Drop all tables and reset with tournament.sql"""
+    """Remove all players, tournaments and matches from the database.
+    
+    The schema is migrated first if need be.  An up-to-date schema is just
+    emptied, rather than dropped and set up again from tournament.sql.  A
+    database set up before the schema was versioned is dropped and set up
+    afresh.
+    """
     conn, cursor = connect()
-    cursor.execute("DROP TABLE IF EXISTS players CASCADE;")
-    cursor.execute("DROP TABLE IF EXISTS tournaments CASCADE;")
-    cursor.execute("DROP TABLE IF EXISTS tournament_players CASCADE;")
-    cursor.execute("DROP TABLE IF EXISTS matches CASCADE;")
-    cursor.execute(open("tournament.sql", "r").read())
+    if schemaVersion(cursor) == 0:
+        cursor.execute("DROP TABLE IF EXISTS players CASCADE;")
+        cursor.execute("DROP TABLE IF EXISTS tournaments CASCADE;")
+        cursor.execute("DROP TABLE IF EXISTS tournament_players CASCADE;")
+        cursor.execute("DROP TABLE IF EXISTS matches CASCADE;")
+        cursor.execute("DROP TABLE IF EXISTS final_standings CASCADE;")
+        cursor.execute("DROP TABLE IF EXISTS player_scores CASCADE;")
+        cursor.execute("DROP SCHEMA IF EXISTS archive CASCADE;")
+    migrated = migrate(cursor)
+    if not migrated:
+        cursor.execute("SELECT clear_all();")
     conn.commit()
+    _wrote(cursor)
     conn.close()
+    if migrated:
+        closePool()     # no statement prepared before a migration outlives it
     
 
 def deleteMatches():
     """Remove all match records from the database."""
     conn, cursor = connect()
     cursor.execute("DELETE FROM matches;")
+    cursor.execute("""UPDATE player_scores
+                      SET wins = 0, draws = 0, losses = 0, points = 0,
+                          buchholz = 0, median_buchholz = 0,
+                          sonneborn_berger = 0;
+                   """)
     conn.commit()
+    _wrote(cursor)
     conn.close()
     
 
@@ -46,21 +292,25 @@ def deletePlayers():
     conn, cursor = connect()
     cursor.execute("DELETE FROM players WHERE id <> 1;")
     conn.commit()
+    _wrote(cursor)
     conn.close()
 
 
 def deleteTournaments():
-    """Remove all tournament records from the database."""
+    """Remove all tournament records, and their partitions, from the
+    database."""
     conn, cursor = connect()
-    cursor.execute("DELETE FROM tournaments CASCADE;")
+    cursor.execute("SELECT drop_partitions(id) FROM tournaments;")
+    cursor.execute("DELETE FROM tournaments;")
     conn.commit()
+    _wrote(cursor)
     conn.close()
 
 
 def countPlayers():
     """Returns the number of players currently registered."""
-    conn, cursor = connect()
-    cursor.execute("SELECT COUNT(*) AS num FROM players WHERE id <> 1;")
+    conn, cursor = _read()
+    executePrepared(cursor, 'count_players')
     num = cursor.fetchall()
     conn.close()
     return num[0][0]
@@ -83,6 +333,7 @@ def registerPlayer(name):
     cursor.execute(query, [name])
     id = cursor.fetchone()[0]
     conn.commit()
+    _wrote(cursor)
     conn.close()
     return id
 
@@ -95,8 +346,8 @@ def getTournaments():
         id: the tournament id
         name: the tournament name
     """
-    conn, cursor = connect()
-    cursor.execute("SELECT * FROM tournaments;")
+    conn, cursor = _read()
+    cursor.execute("SELECT id, name FROM tournaments;")
     tournaments = cursor.fetchall()
     conn.close()
     return tournaments
@@ -112,8 +363,9 @@ def getTournamentByName(name):
         id: tournament id matching name
         name: name
     """
-    conn, cursor = connect()
-    cursor.execute("SELECT * FROM tournaments WHERE name = %s;", [name])
+    conn, cursor = _read()
+    cursor.execute("SELECT id, name FROM tournaments WHERE name = %s;",
+                   [name])
     tournaments = cursor.fetchall()
     conn.close()
     return tournaments
@@ -127,8 +379,8 @@ def getTournamentById(id):
         id: tournament id matching name
         name: name
     """
-    conn, cursor = connect()
-    cursor.execute("SELECT * FROM tournaments WHERE id = %s;", [id])
+    conn, cursor = _read()
+    cursor.execute("SELECT id, name FROM tournaments WHERE id = %s;", [id])
     tournaments = cursor.fetchone()
     conn.close()
     return tournaments
@@ -140,13 +392,91 @@ def getByeId():
     Returns:
       int: id used to represent a bye
     """
-    conn, cursor = connect()
+    conn, cursor = _read()
     cursor.execute("SELECT id FROM players WHERE name = 'bye';")
     id = cursor.fetchone()[0]
     conn.close()
     return id
 
 
+def allStandings(tournament_ids=None, top=None):
+    """Retrieve standings for many tournaments in a single query.
+    
+    Each tournament's players are numbered in standings order with a window
+    function, so cutting every tournament down to its top players happens
+    in the database.
+    
+    Args:
+      tournament_ids: list of tournament ids, default all tournaments
+      top: number of players to return per tournament, default all
+    
+    Returns:
+      OrderedDict, in tournament id order, mapping each tournament's
+      (id, name) tuple, the same tuple getTournaments() returns for it, to
+      a list of (id, name, wins, draws, losses) tuples in playerStandings()
+      order.  Tournaments with no players map to empty lists
+    """
+    conn, cursor = _read()
+    args = []
+    # Cut to the top players in the join, so tournaments without players
+    # still come back, with NULL players
+    join = "true"
+    if top is not None:
+        join = "s.place <= %s"
+        args.append(top)
+    where = ""
+    if tournament_ids is not None:
+        where = "WHERE t.id = ANY(%s::int[])"
+        args.append(list(tournament_ids))
+    query = """SELECT t.id, t.name, s.id, s.name, s.wins, s.draws, s.losses
+               FROM tournaments AS t
+               LEFT JOIN LATERAL
+                   (SELECT *, row_number() OVER
+                        (ORDER BY wins DESC, draws DESC, points DESC, id DESC)
+                        AS place
+                    FROM get_ranked_standings_from_tourn(t.id)) AS s
+               ON {}
+               {}
+               ORDER BY t.id, s.place;
+            """.format(join, where)
+    cursor.execute(query, args)
+    standings = OrderedDict()
+    for row in cursor:
+        players = standings.setdefault(row[:2], [])
+        if row[2] is not None:
+            players.append(row[2:])
+    conn.close()
+    return standings
+
+
+def lockTournament(cursor, tournament_id, shared=False):
+    """Take a tournament's advisory lock until the transaction ends.
+    
+    Reports take the lock shared, so they never wait on each other here.
+    Only reports involving the same players or their opponents take turns,
+    on those players' player_scores rows.  Pairing takes it exclusive, so it
+    waits for reports in flight and none start until it has read the
+    standings.
+    
+    Returns:
+      float: seconds spent waiting for the lock
+    """
+    start = time.time()
+    if shared:
+        cursor.execute("SELECT pg_advisory_xact_lock_shared(%s, %s);",
+                       [LOCK_NAMESPACE, tournament_id])
+    else:
+        cursor.execute("SELECT pg_advisory_xact_lock(%s, %s);",
+                       [LOCK_NAMESPACE, tournament_id])
+    return time.time() - start
+
+
+def journalPath(journal_dir, tournament_id):
+    """Return the path of a tournament's journal file in journal_dir."""
+    return os.path.join(journal_dir, 'tournament_{}.journal'.format(
+        tournament_id))
+
+
 class Tournament():
     """Encapsulates id, name, and methods of a tournament.
     
@@ -158,19 +488,77 @@ class Tournament():
     reporting and deleting matches occurring within a tournament, reporting 
     tournament standings and determining tournament pairings are provided.
     
+    Roster changes and match reports can optionally also be written to an
+    append-only journal, from which a pairing worker can rebuild its state
+    without querying the database (see journal.py).
+    
     Attributes:
       id: id of the tournament
       name: name of the tournament
+      journal: MatchJournal the tournament's events are written to, or None
+      lock_wait: seconds the last reportMatch() or swissPairings() call
+        waited for the tournament's advisory lock
+      read_your_writes: whether reads wait for this object's own writes
+      written_lsn: primary WAL location after this object's last write, if
+        read_your_writes is set and a replica is configured
     """
     
-    def __init__(self, name, id=None):
-        """Set id and name, registering a new tournament if no id given."""
+    def __init__(self, name, id=None, journal_dir=None,
+                 read_your_writes=False):
+        """Set id and name, registering a new tournament if no id given.
+        
+        If journal_dir is given, events are also appended to the journal
+        file for this tournament in that directory, which is kept open
+        until close().
+        
+        Reads are sent to the replica, if one is configured.  With
+        read_your_writes, a score-keeper's standings always include their
+        own reports: reads go to the primary until the replica has caught
+        up with this object's last write.
+        """
         self.name = name
+        self.read_your_writes = read_your_writes
+        self.written_lsn = None
         if id is None:
             self._register()
         else:
             self.id = id
+        self.lock_wait = 0.0
+        self.journal = None
+        if journal_dir is not None:
+            from journal import MatchJournal
+            self.journal = MatchJournal(journalPath(journal_dir, self.id))
+
+    def close(self):
+        """Close the tournament's journal, if it has one."""
+        if self.journal is not None:
+            self.journal.close()
+            self.journal = None
 
+    def _read(self):
+        """Connect for reads that must see this object's own writes, and
+        with read_your_writes, those of module-level functions too."""
+        after = self.written_lsn
+        if self.read_your_writes:
+            after = _latestLSN(after, getattr(_session, 'written_lsn', None))
+        return connect(read=True, after=after)
+
+    def _wrote(self, cursor):
+        """Note the WAL location of a write just committed on cursor."""
+        if self.read_your_writes and REPLICA_DSN:
+            self.written_lsn = currentLSN(cursor)
+
+    def _finished(self, conn, cursor):
+        """Roll back, and return whether the tournament is finished.
+        
+        A finished tournament has no partitions, so inserting its entries or
+        matches fails and deleting them changes nothing.
+        """
+        conn.rollback()
+        cursor.execute("SELECT finished FROM tournaments WHERE id = %s;",
+                       [self.id])
+        finished = cursor.fetchone()
+        return finished is not None and finished[0]
         
     def _register(self):
         """Adds tournament to the tournament database.
@@ -186,9 +574,127 @@ class Tournament():
         cursor.execute(query, [self.name])
         self.id = cursor.fetchone()[0]
         conn.commit()
+        self._wrote(cursor)
+        conn.close()
+        
+        
+    def export(self, path):
+        """Write the tournament to a compact binary snapshot file.
+        
+        The snapshot holds the tournament name, every entered player's id,
+        name, record, opponent points and opponents, and every match in the
+        order reported.  See binary_export.py for the format.
+        
+        Args:
+          path: path of the file to write
+        """
+        conn, cursor = self._read()
+        query = """SELECT * FROM get_info_for_pairing_from_tourn(%s);"""
+        cursor.execute(query, [self.id])
+        player_info = cursor.fetchall()
+        query = """SELECT winner, loser, draw FROM matches
+                   WHERE tournament = %s ORDER BY id;
+                """
+        cursor.execute(query, [self.id])
+        matches = cursor.fetchall()
+        conn.close()
+        write_export(path, self.name, player_info, matches)
+
+    @classmethod
+    def import_(cls, path, name=None, read_your_writes=False):
+        """Register a new tournament from a snapshot written by export().
+        
+        Players are registered afresh, so they get new ids in this database.
+        Everything is loaded with COPY into temporary staging tables and
+        inserted set-wise in a single transaction, and the tournament's
+        tiebreaks are built once at the end.
+        
+        Args:
+          path: path of the snapshot file
+          name: name for the new tournament, default the exported name
+          read_your_writes: as for Tournament(), for the new tournament
+        
+        Returns:
+          Tournament: the newly registered tournament
+        """
+        export = TournamentExport(path)
+        if name is None:
+            name = export.name
+        conn, cursor = connect()
+        query = """INSERT INTO tournaments (name) VALUES(%s) RETURNING id;"""
+        cursor.execute(query, [name])
+        id = cursor.fetchone()[0]
+        # The scores triggers handle one match per statement, so are skipped
+        # and the scores rebuilt once everything is in
+        cursor.execute("SET LOCAL tournament.bulk_load = 'on';")
+        
+        cursor.execute("""CREATE TEMP TABLE import_players
+                              (old_id INT PRIMARY KEY, name TEXT, new_id INT)
+                          ON COMMIT DROP;
+                       """)
+        rows = ((export.ids[i], export.playerName(i))
+                for i in range(len(export.ids)))
+        cursor.copy_from(StringIO(copy_rows(rows)), 'import_players',
+                         columns=('old_id', 'name'))
+        cursor.execute("""UPDATE import_players
+                          SET new_id = nextval('players_id_seq');
+                       """)
+        cursor.execute("""INSERT INTO players (id, name)
+                          SELECT new_id, name FROM import_players;
+                       """)
+        cursor.execute("""INSERT INTO tournament_players (tournament, player)
+                          SELECT %s, new_id FROM import_players;
+                       """, [id])
+        
+        # Matches against players no longer entered can't be mapped to new
+        # ids and are left out.  The bye is id 1 in every database
+        cursor.execute("""CREATE TEMP TABLE import_matches
+                              (seq SERIAL, winner INT, loser INT,
+                               draw BOOLEAN)
+                          ON COMMIT DROP;
+                       """)
+        cursor.copy_from(StringIO(copy_rows(export.matches())),
+                         'import_matches', columns=('winner', 'loser', 'draw'))
+        query = """INSERT INTO matches (tournament, winner, loser, draw)
+                   SELECT %s, COALESCE(w.new_id, m.winner),
+                          COALESCE(l.new_id, m.loser), m.draw
+                   FROM import_matches AS m
+                   LEFT JOIN import_players AS w ON m.winner = w.old_id
+                   LEFT JOIN import_players AS l ON m.loser = l.old_id
+                   WHERE (w.new_id IS NOT NULL OR m.winner = %s)
+                     AND (l.new_id IS NOT NULL OR m.loser = %s)
+                   ORDER BY m.seq;
+                """
+        cursor.execute(query, [id, BYE, BYE])
+        cursor.execute("SELECT rebuild_player_scores(%s);", [id])
+        conn.commit()
+        tournament = cls(name, id, read_your_writes=read_your_writes)
+        # The import registers players as well as the tournament
+        _wrote(cursor)
+        tournament._wrote(cursor)
         conn.close()
+        return tournament
+
+    def finish(self, archive=True):
+        """Freeze the final standings and retire the tournament's matches.
         
+        Final standings are stored in the final_standings table, where
+        playerStandings() and the other standings methods keep finding
+        them.  The tournament's partitions of tournament_players and matches
+        are then detached, so queries about live tournaments no longer
+        share tables with it.  No more matches can be reported.
         
+        Args:
+          archive: if True (default) the detached partitions are kept in the
+            archive schema, else they are dropped
+        """
+        conn, cursor = connect()
+        self.lock_wait = lockTournament(cursor, self.id)
+        cursor.execute("SELECT finish_tournament(%s, %s);", [self.id, archive])
+        conn.commit()
+        self._wrote(cursor)
+        conn.close()
+
     def deleteMatches(self):
         """Remove match records from the database.
         
@@ -197,8 +703,12 @@ class Tournament():
         """
         conn, cursor = connect()
         cursor.execute("DELETE FROM matches WHERE tournament = %s;", [self.id])
+        cursor.execute("SELECT rebuild_player_scores(%s);", [self.id])
         conn.commit()
+        self._wrote(cursor)
         conn.close()
+        if self.journal is not None:
+            self.journal.deleteMatches()
 
         
     def countPlayers(self):
@@ -207,12 +717,8 @@ class Tournament():
         Returns:
           int: number of players in entered in this tournament
         """
-        conn, cursor = connect()
-        query = """SELECT COUNT(*) AS num
-                   FROM tournament_players
-                   WHERE tournament = %s;
-                """
-        cursor.execute(query, [self.id])
+        conn, cursor = self._read()
+        executePrepared(cursor, 'count_tournament_players', [self.id])
         num = cursor.fetchall()
         conn.close()
         return num[0][0]
@@ -223,14 +729,33 @@ class Tournament():
         
         Args:
           player_id: id of the player to be added
+        
+        Raises:
+          ValueError: the tournament is finished
         """
         conn, cursor = connect()
         query = """INSERT INTO tournament_players (tournament, player) 
                    VALUES(%s, %s);
                 """
-        cursor.execute(query, [self.id, player_id])
+        try:
+            cursor.execute(query, [self.id, player_id])
+        except psycopg2.IntegrityError:
+            finished = self._finished(conn, cursor)
+            conn.close()
+            if finished:
+                raise ValueError(
+                    "Tournament {} is finished, so no more players can be "
+                    "entered".format(self.id))
+            raise
+        if self.journal is not None:
+            cursor.execute("SELECT name FROM players WHERE id = %s;",
+                           [player_id])
+            name = cursor.fetchone()[0]
         conn.commit()
+        self._wrote(cursor)
         conn.close()
+        if self.journal is not None:
+            self.journal.enterPlayer(player_id, name)
 
         
     def removePlayer(self, player_id):
@@ -238,14 +763,32 @@ class Tournament():
         
         Args:
           player_id: id of the player to be removed
+        
+        Raises:
+          ValueError: the tournament is finished
         """
         conn, cursor = connect()
         query = """DELETE FROM tournament_players
                    WHERE tournament = %s AND player = %s;
                 """
-        cursor.execute(query, [self.id, player_id])
+        try:
+            cursor.execute(query, [self.id, player_id])
+            finished = not cursor.rowcount and self._finished(conn, cursor)
+        except psycopg2.IntegrityError:
+            finished = self._finished(conn, cursor)
+            if not finished:
+                conn.close()
+                raise
+        if finished:
+            conn.close()
+            raise ValueError(
+                "Tournament {} is finished, so no players can be "
+                "removed".format(self.id))
         conn.commit()
+        self._wrote(cursor)
         conn.close()
+        if self.journal is not None:
+            self.journal.removePlayer(player_id)
 
     def playerStandings(self):
         """Returns a list of the players and their win/draw/loss records.
@@ -264,42 +807,167 @@ class Tournament():
             draws: the number of matches the player has drawn
             losses: the number of matches the player has lost
         """
-        conn, cursor = connect()
+        conn, cursor = self._read()
+        executePrepared(cursor, 'standings', [self.id])
+        standings = cursor.fetchall()
+        conn.close()
+        return standings
+
+    def iterStandings(self, batch_size=1000):
+        """Yields player standings one at a time, in playerStandings() order.
+        
+        Rows are streamed from a named server-side cursor in batches, so the
+        full standings are never held in memory at once.  The connection
+        stays open until the generator is exhausted or closed.
+        
+        Args:
+          batch_size: number of rows fetched from the server at a time
+        
+        Yields:
+          (id, name, wins, draws, losses) tuples, as in playerStandings()
+        """
+        conn, _ = self._read()
+        try:
+            cursor = conn.cursor(name='standings_{}'.format(self.id))
+            cursor.itersize = batch_size
+            query = """SELECT id, name, wins, draws, losses
+                       FROM get_standings_page(%s, NULL, NULL);
+                    """
+            cursor.execute(query, [self.id])
+            for row in cursor:
+                yield row
+            cursor.close()
+        finally:
+            conn.close()
+
+    def standingsPage(self, after=None, limit=50):
+        """Returns one page of player standings, in playerStandings() order.
+        
+        Pages are keyset paginated: rather than an OFFSET, each page starts
+        after the last player of the previous one, so later pages cost no
+        more than the first.
+        
+        Args:
+          after: id of the last player on the previous page, or None for the
+            first page
+          limit: maximum number of players on the page
+        
+        Returns:
+          A list of (id, name, wins, draws, losses) tuples, as in
+          playerStandings()
+        """
+        conn, cursor = self._read()
         query = """SELECT id, name, wins, draws, losses
-                    FROM get_standings_from_tourn(%s)
-                    LEFT JOIN get_opponent_points_from_tourn(%s)
-                    USING (id)            
-                    ORDER BY wins DESC, draws DESC, points DESC;
+                   FROM get_standings_page(%s, %s, %s);
                 """
-        cursor.execute(query, [self.id, self.id])
+        cursor.execute(query, [self.id, after, limit])
         standings = cursor.fetchall()
         conn.close()
         return standings
 
-    def reportMatch(self, winner, loser, draw=False):
+    def topStandings(self, n=8):
+        """Returns the top n players, as in playerStandings()."""
+        return self.standingsPage(limit=n)
+
+    def playerTiebreaks(self):
+        """Returns each player's points and tiebreaks, in pairing order.
+
+        Tiebreaks are kept up to date by the database as matches are
+        reported, so this reads them rather than computing them.
+
+        Returns:
+          A list of tuples (id, name, points, buchholz, median_buchholz,
+          sonneborn_berger), ordered as players are for pairing:
+            points: 3 for each win and 1 for each draw
+            buchholz: sum of opponents' points
+            median_buchholz: buchholz without the best and worst opponents,
+              once the player has had three or more
+            sonneborn_berger: points of opponents beaten plus half the
+              points of opponents drawn with
+        """
+        conn, cursor = self._read()
+        query = """SELECT p.id, p.name, s.points, s.buchholz,
+                          s.median_buchholz, s.sonneborn_berger
+                   FROM player_scores AS s JOIN players AS p
+                   ON s.player = p.id
+                   WHERE s.tournament = %s
+                   ORDER BY s.wins DESC, s.draws DESC, s.buchholz DESC,
+                            s.sonneborn_berger DESC, s.median_buchholz DESC,
+                            p.id;
+                """
+        cursor.execute(query, [self.id])
+        tiebreaks = cursor.fetchall()
+        conn.close()
+        return tiebreaks
+
+    def reportMatch(self, winner, loser, draw=False, round=None, board=None):
         """Records the outcome of a single match between two players.
+        
+        If round and board are given, only one result can be recorded for
+        that board, so score-keepers reporting the same match at once can't
+        record it twice.
 
         Args:
           winner:  the id number of the player who won
           loser:  the id number of the player who lost
           draw: Whether match was a draw, default is false
+          round: the round number, optional
+          board: the board number within the round, optional
+          
+        Returns:
+          bool: True if the result was recorded, False if the same result
+            had already been recorded for this round and board
+            
+        Raises:
+          ValueError: a different result was already recorded for this round
+            and board, or the tournament is finished
         """
         conn, cursor = connect()
-        query = """INSERT INTO matches (tournament, winner, loser, draw) 
-                   VALUES (%s, %s, %s, %s);"""
-        cursor.execute(query, [self.id, winner, loser, draw])
+        self.lock_wait = lockTournament(cursor, self.id, shared=True)
+        try:
+            executePrepared(cursor, 'report_match',
+                            [self.id, round, board, winner, loser, draw])
+        except psycopg2.IntegrityError:
+            finished = self._finished(conn, cursor)
+            conn.close()
+            if finished:
+                raise ValueError(
+                    "Tournament {} is finished, so no more matches can be "
+                    "reported".format(self.id))
+            raise
+        if cursor.fetchone() is None:
+            query = """SELECT winner, loser, draw FROM matches
+                       WHERE tournament = %s AND round = %s AND board = %s;
+                    """
+            cursor.execute(query, [self.id, round, board])
+            existing = cursor.fetchone()
+            conn.close()
+            if draw and existing[2]:
+                same = set(existing[:2]) == set([winner, loser])
+            else:
+                same = existing == (winner, loser, draw)
+            if not same:
+                raise ValueError(
+                    "Round {} board {} already has a different result".format(
+                        round, board))
+            return False
         conn.commit()
+        self._wrote(cursor)
         conn.close()
+        if self.journal is not None:
+            self.journal.reportMatch(winner, loser, draw)
+        return True
 
     # A couple of helper functions
-    def reportBye(self, player):
-        self.reportMatch(player, BYE)
+    def reportBye(self, player, round=None, board=None):
+        return self.reportMatch(player, BYE, round=round, board=board)
 
-    def reportDraw(self, player1, player2):
-        self.reportMatch(player1, player2, True)
+    def reportDraw(self, player1, player2, round=None, board=None):
+        return self.reportMatch(player1, player2, True, round, board)
      
      
-    def swissPairings(self):
+    def swissPairings(self, engine='blossom', on_infeasible='rematch',
+                      lookahead=0):
         """Returns a list of pairs of players for the next round of a match.
       
         Calls get_pairs() from binning_and_graph_construction.py.  This 
@@ -317,6 +985,25 @@ class Tournament():
         
         A chief strength of this method is that rematches do not occur.
         
+        Standings are read under the tournament's exclusive advisory lock, so
+        no report is half recorded while they are read.
+        
+        For very large fields, engine='greedy' uses a near-linear pairing
+        pass over the same groups instead of the full matching.
+        
+        If no pairing without rematches exists, the default on_infeasible
+        policy of 'rematch' allows the least recent rematches needed to pair
+        everyone.
+        
+        Late in small events, lookahead avoids pairings that would leave no
+        pairing without rematches for one of the rounds still to come.
+        
+        Args:
+          engine: pairing engine to use, 'blossom' (default) or 'greedy'
+          on_infeasible: 'rematch' (default), 'partial' to leave unpairable
+            players out, or 'raise' to raise ValueError
+          lookahead: number of rounds left to play after this one
+        
         Returns:
           A list of tuples, each of which contains (id1, name1, id2, name2)
             id1: the first player's unique id
@@ -325,9 +1012,38 @@ class Tournament():
             name2: the second player's name
         """
         conn, cursor = connect()
-        query = """SELECT * FROM get_info_for_pairing_from_tourn(%s);"""
-        cursor.execute(query, [self.id])
+        self.lock_wait = lockTournament(cursor, self.id)
+        executePrepared(cursor, 'pairing_info', [self.id])
         pairing_info = cursor.fetchall()
+        conn.commit()
         conn.close()
-        pairings = get_pairs(pairing_info)
+        # Imported here so scripts that never pair don't load networkx
+        from binning_and_graph_construction import get_pairs
+        pairings = get_pairs(pairing_info, engine, on_infeasible, lookahead)
         return pairings
+
+    def projectStandings(self, rounds, simulations=10000, top=8):
+        """Returns each player's chances of where they will finish.
+
+        Plays out the remaining rounds many times over with
+        project_standings() from projection.py, which needs NumPy.
+
+        Args:
+          rounds: number of rounds left to play
+          simulations: number of times to play out the remaining rounds
+          top: size of the top cut whose odds are reported
+
+        Returns:
+          A list of tuples in current standings order, each of which
+          contains (id, name, top_odds, mean_place, places):
+            top_odds: chance of finishing in the top places
+            mean_place: expected final place, first place being 1
+            places: NumPy array of the chance of finishing in each place
+        """
+        # Imported here so NumPy is only loaded when projections are made
+        from projection import project_standings
+        conn, cursor = self._read()
+        executePrepared(cursor, 'pairing_info', [self.id])
+        pairing_info = cursor.fetchall()
+        conn.close()
+        return project_standings(pairing_info, rounds, simulations, top)
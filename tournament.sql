@@ -11,25 +11,121 @@ CREATE TABLE players (
 	name TEXT
 );
 
+-- A tournament is finished once its final standings are frozen into
+-- final_standings
 CREATE TABLE tournaments (
 	id SERIAL PRIMARY KEY,
-	name TEXT
+	name TEXT,
+	finished BOOLEAN NOT NULL DEFAULT FALSE
 );
 
+-- tournament_players and matches are partitioned by tournament, so queries
+-- about a live tournament never touch the rows of any other.  Each tournament
+-- gets its own partitions when it is registered (see create_partitions)
 CREATE TABLE tournament_players (
 	tournament INT REFERENCES tournaments (id) ON DELETE CASCADE,
 	player INT REFERENCES players (id) ON DELETE CASCADE
-);
+) PARTITION BY LIST (tournament);
 
 -- Every match has the id of the tournament it occurred in, a winner, a loser,
--- and a draw flag
+-- and a draw flag.  Match ids increase in the order matches are reported.
+-- Round and board are optional, but a board can only have one result a round
 CREATE TABLE matches (
+	id SERIAL,
 	tournament INT REFERENCES tournaments (id),
+	round INT,
+	board INT,
 	winner INT REFERENCES players (id),
 	loser INT REFERENCES players (id),
-	draw BOOLEAN
+	draw BOOLEAN,
+	PRIMARY KEY (tournament, id),
+	UNIQUE (tournament, round, board)
+) PARTITION BY LIST (tournament);
+
+-- Almost every query is limited to a single tournament
+CREATE INDEX tournament_players_tournament_idx
+	ON tournament_players (tournament, player);
+CREATE INDEX matches_tournament_idx ON matches (tournament);
+CREATE INDEX matches_winner_idx ON matches (tournament, winner);
+CREATE INDEX matches_loser_idx ON matches (tournament, loser);
+
+-- Final standings of finished tournaments, whose match partitions have been
+-- detached.  Columns as returned by get_ranked_standings_from_tourn
+CREATE TABLE final_standings (
+	tournament INT REFERENCES tournaments (id) ON DELETE CASCADE,
+	id INT,
+	name TEXT,
+	wins BIGINT,
+	draws BIGINT,
+	losses BIGINT,
+	points BIGINT,
+	PRIMARY KEY (tournament, id)
 );
 
+-- Record, points (3 for a win, 1 for a draw) and tiebreaks of every player in
+-- a live tournament, kept up to date as matches are reported (see
+-- update_player_scores) rather than aggregated from matches on every read.
+-- buchholz is the sum of opponents' points, the opponent points standings are
+-- ranked by.  median_buchholz leaves out the best and worst opponents once a
+-- player has three or more, and sonneborn_berger sums the points of opponents
+-- beaten plus half the points of opponents drawn with.  Byes aren't opponents
+CREATE TABLE player_scores (
+	tournament INT REFERENCES tournaments (id) ON DELETE CASCADE,
+	player INT REFERENCES players (id) ON DELETE CASCADE,
+	wins BIGINT NOT NULL DEFAULT 0,
+	draws BIGINT NOT NULL DEFAULT 0,
+	losses BIGINT NOT NULL DEFAULT 0,
+	points BIGINT NOT NULL DEFAULT 0,
+	buchholz BIGINT NOT NULL DEFAULT 0,
+	median_buchholz BIGINT NOT NULL DEFAULT 0,
+	sonneborn_berger NUMERIC NOT NULL DEFAULT 0,
+	PRIMARY KEY (tournament, player)
+);
+
+-- Standings are read in this order a page at a time (see
+-- get_standings_page), so each page is an index range scan rather than a
+-- sort of the whole tournament
+CREATE INDEX player_scores_standings_idx ON player_scores
+	(tournament, wins DESC, draws DESC, buchholz DESC, player DESC);
+CREATE INDEX final_standings_standings_idx ON final_standings
+	(tournament, wins DESC, draws DESC, points DESC, id DESC);
+
+-- Detached partitions of finished tournaments are kept here
+CREATE SCHEMA IF NOT EXISTS archive;
+
+-- Trigger function creating the tournament_players and matches partitions
+-- for each newly registered tournament
+CREATE OR REPLACE FUNCTION create_partitions() RETURNS trigger AS $$
+BEGIN
+	EXECUTE format('CREATE TABLE %I PARTITION OF tournament_players '
+				   'FOR VALUES IN (%s)', 'tournament_players_' || NEW.id, NEW.id);
+	EXECUTE format('CREATE TABLE %I PARTITION OF matches '
+				   'FOR VALUES IN (%s)', 'matches_' || NEW.id, NEW.id);
+	RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER create_partitions AFTER INSERT ON tournaments
+	FOR EACH ROW EXECUTE PROCEDURE create_partitions();
+
+-- Drops a tournament's partitions, and with them its entries and matches,
+-- whether live or archived, so the tournament itself can be deleted
+CREATE OR REPLACE FUNCTION drop_partitions(int) RETURNS void AS $$
+BEGIN
+	EXECUTE format('DROP TABLE IF EXISTS %I, %I, archive.%I, archive.%I',
+				   'tournament_players_' || $1, 'matches_' || $1,
+				   'tournament_players_' || $1, 'matches_' || $1);
+END;
+$$ LANGUAGE plpgsql;
+
+-- Functions whose return types have changed can't be replaced in place
+DROP FUNCTION IF EXISTS get_matches_from_tourn(int) CASCADE;
+DROP FUNCTION IF EXISTS get_player_opponents_from_tourn(int) CASCADE;
+
+-- The query functions below only read, and are declared STABLE so the planner
+-- can inline them into the queries that call them and plan the whole chain
+-- at once, rather than running each one separately as an opaque function
+
 -- Returns a table with names and ids of players in specified tournament
 CREATE OR REPLACE FUNCTION get_players_from_tourn(int)
 RETURNS TABLE(id int, name text, tournament int) AS $$
@@ -37,20 +133,21 @@ RETURNS TABLE(id int, name text, tournament int) AS $$
 	FROM tournament_players as tp LEFT JOIN players
 	ON tp.player = players.id
 	WHERE tp.tournament = $1;
-$$ LANGUAGE SQL;
+$$ LANGUAGE SQL STABLE;
 
 -- Returns a table with every match (listed twice for winner and loser)
--- with player id, name, winner id, loser id, whether it was a draw for the
--- specified tournament
+-- with player id, name, winner id, loser id, whether it was a draw and the
+-- match id for the specified tournament
 CREATE OR REPLACE FUNCTION get_matches_from_tourn(int)
 RETURNS TABLE(id int, name text, winner int, 
-			  loser int, draw boolean, tournament int) AS $$
-	SELECT id, name, winner, loser, draw, t_players.tournament
+			  loser int, draw boolean, tournament int, match_id int) AS $$
+	SELECT t_players.id, name, winner, loser, draw, t_players.tournament,
+		   matches.id
 	FROM get_players_from_tourn($1) as t_players LEFT JOIN matches
 	ON (t_players.id = matches.winner OR 
 		t_players.id = matches.loser) AND 
 		matches.tournament = t_players.tournament
-$$ LANGUAGE SQL;
+$$ LANGUAGE SQL STABLE;
 
 -- Returns a table listing all the players and their win/draw/loss record for
 -- a specified tournament
@@ -64,65 +161,345 @@ RETURNS TABLE(id int, name text, tournament int,
 		   SUM(CASE WHEN loser=id AND draw=FALSE THEN 1 ELSE 0 END) AS losses
 		FROM get_matches_from_tourn($1)
 	GROUP BY id, name, tournament;
-$$ LANGUAGE SQL;
-
--- Returns table with list of player ids and their associated points (3 for a 
--- win, 1 for a draw, 0 for a loss) for a specified tournament
-CREATE OR REPLACE FUNCTION get_player_points_from_tourn(int)
-RETURNS TABLE(id int, points bigint) AS $$
-	SELECT id,
-		SUM(CASE WHEN winner=id AND draw=FALSE THEN 3
-				 WHEN (winner=id OR loser=id) AND draw=TRUE THEN 1
-				 ELSE 0 END) as points
-	FROM get_matches_from_tourn($1)
-	GROUP BY id
-	ORDER BY points DESC;
-$$ LANGUAGE SQL;
+$$ LANGUAGE SQL STABLE;
 
--- Returns table with players ids, name, and opponent for a specified tournament
+-- Returns table with players ids, name, opponent and match id for a specified
+-- tournament
 CREATE OR REPLACE FUNCTION get_player_opponents_from_tourn(int)
-RETURNS TABLE(id int, name text, opponent int) AS $$
+RETURNS TABLE(id int, name text, opponent int, match_id int) AS $$
 	SELECT id, name,
 		   CASE WHEN winner=id THEN loser
-				WHEN loser = id THEN winner END AS opponent
+				WHEN loser = id THEN winner END AS opponent,
+		   match_id
 	FROM get_matches_from_tourn($1);
-$$ LANGUAGE SQL;
+$$ LANGUAGE SQL STABLE;
 
--- Returns table with player id and their opponents' points from a specified
--- tournament
-CREATE OR REPLACE FUNCTION get_opponent_points_from_tourn(int)
-RETURNS TABLE(id int, points bigint) AS $$
-	SELECT A.id, SUM(B.points::int) as points
-	FROM get_player_opponents_from_tourn($1) A
-	JOIN get_player_points_from_tourn($1) B
-	ON A.opponent = B.id
-	GROUP BY A.id;
+-- Returns table with player id, record, points and tiebreaks for a specified
+-- tournament, computed from scratch from its matches
+CREATE OR REPLACE FUNCTION compute_player_scores_from_tourn(int)
+RETURNS TABLE(player int, wins bigint, draws bigint, losses bigint,
+			  points bigint, buchholz bigint, median_buchholz bigint,
+			  sonneborn_berger numeric) AS $$
+	WITH standings AS (
+		SELECT id, wins, draws, losses, 3 * wins + draws AS points
+		FROM get_standings_from_tourn($1)
+		WHERE id IS NOT NULL),
+	games AS (
+		SELECT m.id, s.points,
+			   CASE WHEN m.draw THEN 0.5 WHEN m.winner = m.id THEN 1
+					ELSE 0 END AS result
+		FROM get_matches_from_tourn($1) AS m
+		JOIN standings AS s
+		ON s.id = CASE WHEN m.winner = m.id THEN m.loser ELSE m.winner END)
+	SELECT s.id, s.wins, s.draws, s.losses, s.points,
+		   COALESCE(SUM(g.points), 0)::bigint,
+		   COALESCE(CASE WHEN COUNT(g.points) >= 3
+						 THEN SUM(g.points) - MAX(g.points) - MIN(g.points)
+						 ELSE SUM(g.points) END, 0)::bigint,
+		   COALESCE(SUM(g.points * g.result), 0)
+	FROM standings AS s LEFT JOIN games AS g USING (id)
+	GROUP BY s.id, s.wins, s.draws, s.losses, s.points;
+$$ LANGUAGE SQL STABLE;
+
+-- Recomputes player_scores for a specified tournament, for when matches or
+-- players have been removed
+CREATE OR REPLACE FUNCTION rebuild_player_scores(int) RETURNS void AS $$
+	SELECT 1 FROM tournaments WHERE id = $1 FOR NO KEY UPDATE;
+	SELECT 1 FROM player_scores WHERE tournament = $1
+	ORDER BY player FOR UPDATE;
+	DELETE FROM player_scores WHERE tournament = $1;
+	INSERT INTO player_scores
+		SELECT $1, * FROM compute_player_scores_from_tourn($1);
 $$ LANGUAGE SQL;
 
+-- Returns table with player id, name, win/draw/loss record and opponent points
+-- for a specified tournament.  Every player has a player_scores row, so
+-- (wins, draws, points, id) gives every player a distinct place for paging.
+-- Finished tournaments have their standings read from final_standings
+CREATE OR REPLACE FUNCTION get_ranked_standings_from_tourn(int)
+RETURNS TABLE(id int, name text, wins bigint, draws bigint, losses bigint,
+			  points bigint) AS $$
+	SELECT players.id, name, wins, draws, losses, buchholz
+	FROM player_scores JOIN players
+	ON player_scores.player = players.id
+	WHERE player_scores.tournament = $1
+	UNION ALL
+	SELECT id, name, wins, draws, losses, points
+	FROM final_standings
+	WHERE tournament = $1;
+$$ LANGUAGE SQL STABLE;
+
+-- Returns up to $3 rows of get_ranked_standings_from_tourn($1), in standings
+-- order, starting after player $2 (from the first player if $2 is null; all
+-- of them if $3 is null).  Each branch is ordered and limited on its own so
+-- the planner reads it from its standings index and merges the two, which it
+-- can't do for get_ranked_standings_from_tourn's join
+CREATE OR REPLACE FUNCTION get_standings_page(int, int, bigint)
+RETURNS TABLE(id int, name text, wins bigint, draws bigint, losses bigint,
+			  points bigint) AS $$
+	(SELECT player AS id, name, wins, draws, losses, buchholz AS points
+	 FROM player_scores JOIN players
+	 ON player_scores.player = players.id
+	 WHERE tournament = $1
+	 AND ($2 IS NULL OR (wins, draws, buchholz, player) <
+		(SELECT wins, draws, buchholz, player
+		 FROM player_scores
+		 WHERE tournament = $1 AND player = $2))
+	 ORDER BY wins DESC, draws DESC, buchholz DESC, player DESC
+	 LIMIT $3)
+	UNION ALL
+	(SELECT id, name, wins, draws, losses, points
+	 FROM final_standings
+	 WHERE tournament = $1
+	 AND ($2 IS NULL OR (wins, draws, points, id) <
+		(SELECT wins, draws, points, id
+		 FROM final_standings
+		 WHERE tournament = $1 AND id = $2))
+	 ORDER BY wins DESC, draws DESC, points DESC, id DESC
+	 LIMIT $3)
+	ORDER BY wins DESC, draws DESC, points DESC, id DESC
+	LIMIT $3;
+$$ LANGUAGE SQL STABLE;
+
+-- Freezes a tournament's final standings into final_standings and marks it
+-- finished.  If archive is true its partitions are detached and moved to the
+-- archive schema, otherwise they are dropped
+CREATE OR REPLACE FUNCTION finish_tournament(int, boolean) RETURNS void AS $$
+BEGIN
+	IF (SELECT finished FROM tournaments WHERE id = $1) THEN
+		RAISE EXCEPTION 'tournament % is already finished', $1;
+	END IF;
+	INSERT INTO final_standings
+		SELECT $1, * FROM get_ranked_standings_from_tourn($1);
+	DELETE FROM player_scores WHERE tournament = $1;
+	UPDATE tournaments SET finished = TRUE WHERE id = $1;
+	EXECUTE format('ALTER TABLE matches DETACH PARTITION %I',
+				   'matches_' || $1);
+	EXECUTE format('ALTER TABLE tournament_players DETACH PARTITION %I',
+				   'tournament_players_' || $1);
+	IF $2 THEN
+		EXECUTE format('ALTER TABLE %I SET SCHEMA archive', 'matches_' || $1);
+		EXECUTE format('ALTER TABLE %I SET SCHEMA archive',
+					   'tournament_players_' || $1);
+	ELSE
+		EXECUTE format('DROP TABLE %I', 'matches_' || $1);
+		EXECUTE format('DROP TABLE %I', 'tournament_players_' || $1);
+	END IF;
+END;
+$$ LANGUAGE plpgsql;
+
 -- Returns table with each player id occurring once with array of opponents'
--- ids for a given tournament
+-- ids, oldest match first, for a given tournament
 CREATE OR REPLACE FUNCTION aggregate_player_opponents_from_tourn(int)
 RETURNS TABLE(id int, opponents int[]) AS $$
-	SELECT id, array_agg(opponent) 
+	SELECT id, array_agg(opponent ORDER BY match_id) 
 	FROM get_player_opponents_from_tourn($1)
 	GROUP BY id;
-$$ LANGUAGE SQL;
+$$ LANGUAGE SQL STABLE;
 
 -- Returns table with all player ids, names, wins, draws, losses, opponents,
--- and opponent points for a specified tournament
+-- and opponent points for a specified tournament.  Players with the same
+-- record are ordered by their tiebreaks, strongest first, and then by id so
+-- pairings don't depend on the plan chosen
 CREATE OR REPLACE FUNCTION get_info_for_pairing_from_tourn(int)
 RETURNS TABLE(id int, name text, 
 			  wins bigint, draws bigint, losses bigint, 
 			  opponents int[], points bigint) AS $$
-	SELECT id, name, wins, draws, losses, opponents, points FROM
-		(SELECT * 
-		FROM get_standings_from_tourn($1)
-		LEFT JOIN get_opponent_points_from_tourn($1)
-		USING (id)) AS standings 
+	SELECT id, name, wins, draws, losses, opponents, buchholz FROM
+		(SELECT players.id, name, wins, draws, losses, buchholz,
+				median_buchholz, sonneborn_berger
+		FROM player_scores JOIN players
+		ON player_scores.player = players.id
+		WHERE player_scores.tournament = $1) AS standings
 	LEFT JOIN aggregate_player_opponents_from_tourn($1)
 	USING (id)                
-	ORDER BY wins DESC, draws DESC, points DESC;
-$$ LANGUAGE SQL;
+	ORDER BY wins DESC, draws DESC, buchholz DESC, sonneborn_berger DESC,
+			 median_buchholz DESC, id;
+$$ LANGUAGE SQL STABLE;
+
+-- Trigger function updating player_scores for a newly reported match.  Only
+-- the two players and their opponents are touched: the players' records and
+-- points change, each gains the other as an opponent, and everyone who has
+-- played either of them sees that opponent's points go up.  Each insert must
+-- add a single match, as the trigger runs after the whole statement and would
+-- count later rows of the same statement as earlier games.  Bulk loads, and
+-- any other statement inserting many matches, set tournament.bulk_load to
+-- skip this and call rebuild_player_scores once done
+CREATE OR REPLACE FUNCTION update_player_scores() RETURNS trigger AS $$
+DECLARE
+	is_draw boolean := COALESCE(NEW.draw, FALSE);
+	winner_gain int := CASE WHEN is_draw THEN 1 ELSE 3 END;
+	loser_gain int := CASE WHEN is_draw THEN 1 ELSE 0 END;
+BEGIN
+	IF current_setting('tournament.bulk_load', true) = 'on' THEN
+		RETURN NULL;
+	END IF;
+	-- Lock the rows this report changes or reads: the two players and their
+	-- opponents.  Reports sharing any of them take turns, and the rest run
+	-- at once.  Rows are locked in player order, so two reports can't each
+	-- hold a row the other waits for
+	PERFORM 1 FROM player_scores
+	WHERE tournament = NEW.tournament
+	  AND (player IN (NEW.winner, NEW.loser) OR player IN (
+		  SELECT CASE WHEN m.winner IN (NEW.winner, NEW.loser)
+					  THEN m.loser ELSE m.winner END
+		  FROM matches AS m
+		  WHERE m.tournament = NEW.tournament
+			AND (m.winner IN (NEW.winner, NEW.loser) OR
+				 m.loser IN (NEW.winner, NEW.loser))))
+	ORDER BY player
+	FOR NO KEY UPDATE;
+
+	-- Earlier opponents of either player, once per game played against them
+	UPDATE player_scores AS ps
+	SET buchholz = ps.buchholz + d.buchholz,
+		sonneborn_berger = ps.sonneborn_berger + d.sonneborn_berger
+	FROM (SELECT g.opponent, SUM(g.gain) AS buchholz,
+				 SUM(g.gain * g.result) AS sonneborn_berger
+		  FROM (SELECT CASE WHEN m.winner = p.id THEN m.loser
+							ELSE m.winner END AS opponent,
+					   p.gain,
+					   CASE WHEN m.draw THEN 0.5 WHEN m.winner = p.id THEN 0
+							ELSE 1 END AS result
+				FROM matches AS m
+				JOIN (VALUES (NEW.winner, winner_gain),
+							 (NEW.loser, loser_gain)) AS p (id, gain)
+				ON m.winner = p.id OR m.loser = p.id
+				WHERE m.tournament = NEW.tournament AND m.id <> NEW.id) AS g
+		  GROUP BY g.opponent) AS d
+	WHERE ps.tournament = NEW.tournament AND ps.player = d.opponent;
+
+	-- The players' own records and points
+	UPDATE player_scores
+	SET wins = wins + CASE WHEN NOT is_draw AND player = NEW.winner
+						   THEN 1 ELSE 0 END,
+		draws = draws + CASE WHEN is_draw THEN 1 ELSE 0 END,
+		losses = losses + CASE WHEN NOT is_draw AND player = NEW.loser
+							   THEN 1 ELSE 0 END,
+		points = points + CASE WHEN player = NEW.winner
+							   THEN winner_gain ELSE loser_gain END
+	WHERE tournament = NEW.tournament AND player IN (NEW.winner, NEW.loser);
+
+	-- The new game, scored with each opponent's updated points
+	UPDATE player_scores AS ps
+	SET buchholz = ps.buchholz + o.points,
+		sonneborn_berger = ps.sonneborn_berger + o.points *
+			CASE WHEN is_draw THEN 0.5 WHEN ps.player = NEW.winner THEN 1
+				 ELSE 0 END
+	FROM player_scores AS o
+	WHERE ps.tournament = NEW.tournament AND o.tournament = NEW.tournament
+	  AND ((ps.player = NEW.winner AND o.player = NEW.loser) OR
+		   (ps.player = NEW.loser AND o.player = NEW.winner));
+
+	-- Median Buchholz depends on which opponent is best and worst, so is
+	-- recomputed for the two players and everyone who has played them
+	WITH affected AS (
+		SELECT NEW.winner AS player
+		UNION SELECT NEW.loser
+		UNION SELECT CASE WHEN m.winner IN (NEW.winner, NEW.loser)
+						  THEN m.loser ELSE m.winner END
+		FROM matches AS m
+		WHERE m.tournament = NEW.tournament
+		  AND (m.winner IN (NEW.winner, NEW.loser) OR
+			   m.loser IN (NEW.winner, NEW.loser))),
+	opponent_points AS (
+		SELECT a.player, o.points
+		FROM affected AS a
+		JOIN matches AS m
+		ON m.tournament = NEW.tournament
+		   AND (m.winner = a.player OR m.loser = a.player)
+		JOIN player_scores AS o
+		ON o.tournament = NEW.tournament
+		   AND o.player = CASE WHEN m.winner = a.player THEN m.loser
+							   ELSE m.winner END)
+	UPDATE player_scores AS ps
+	SET median_buchholz = mb.median_buchholz
+	FROM (SELECT player,
+				 CASE WHEN COUNT(*) >= 3
+					  THEN SUM(points) - MAX(points) - MIN(points)
+					  ELSE SUM(points) END AS median_buchholz
+		  FROM opponent_points
+		  GROUP BY player) AS mb
+	WHERE ps.tournament = NEW.tournament AND ps.player = mb.player;
+	RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER update_player_scores AFTER INSERT ON matches
+	FOR EACH ROW EXECUTE PROCEDURE update_player_scores();
+
+-- Trigger function giving players entered into a tournament a player_scores
+-- row.  A player re-entered with matches already played changes their
+-- opponents' tiebreaks, so the tournament's scores are rebuilt
+CREATE OR REPLACE FUNCTION enter_player_scores() RETURNS trigger AS $$
+BEGIN
+	IF current_setting('tournament.bulk_load', true) = 'on' THEN
+		RETURN NULL;
+	END IF;
+	INSERT INTO player_scores (tournament, player)
+		VALUES (NEW.tournament, NEW.player)
+		ON CONFLICT DO NOTHING;
+	IF EXISTS (SELECT 1 FROM matches
+			   WHERE tournament = NEW.tournament
+				 AND (winner = NEW.player OR loser = NEW.player)) THEN
+		PERFORM rebuild_player_scores(NEW.tournament);
+	END IF;
+	RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER enter_player_scores AFTER INSERT ON tournament_players
+	FOR EACH ROW EXECUTE PROCEDURE enter_player_scores();
+
+-- Trigger function rebuilding player_scores once per statement removing
+-- players, for each tournament they were removed from, as removed players'
+-- points no longer count towards their opponents' tiebreaks.  Rows deleted
+-- along with their tournament need no rebuilding
+CREATE OR REPLACE FUNCTION remove_player_scores() RETURNS trigger AS $$
+BEGIN
+	IF current_setting('tournament.bulk_load', true) = 'on' THEN
+		RETURN NULL;
+	END IF;
+	PERFORM rebuild_player_scores(id) FROM tournaments
+	WHERE id IN (SELECT tournament FROM removed)
+	ORDER BY id;
+	RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER remove_player_scores AFTER DELETE ON tournament_players
+	REFERENCING OLD TABLE AS removed
+	FOR EACH STATEMENT EXECUTE PROCEDURE remove_player_scores();
+
+-- Empties every table and drops every tournament's partitions, live or
+-- archived, leaving the schema as set up.  Used by clearAll() so the schema
+-- doesn't have to be rebuilt to start again
+CREATE OR REPLACE FUNCTION clear_all() RETURNS void AS $$
+DECLARE
+	partition text;
+BEGIN
+	FOR partition IN
+		SELECT inhrelid::regclass::text FROM pg_inherits
+		WHERE inhparent IN ('tournament_players'::regclass,
+							'matches'::regclass)
+		UNION ALL
+		SELECT format('%I.%I', schemaname, tablename) FROM pg_tables
+		WHERE schemaname = 'archive'
+	LOOP
+		EXECUTE 'DROP TABLE ' || partition;
+	END LOOP;
+	TRUNCATE players, tournaments, tournament_players, matches,
+			 final_standings, player_scores RESTART IDENTITY CASCADE;
+	INSERT INTO players (name) VALUES ('bye');
+END;
+$$ LANGUAGE plpgsql;
+
+-- Version of the schema, as brought up to date by migrate() in tournament.py.
+-- This file sets up version 1; later migrations each raise it by one
+CREATE TABLE schema_version (
+	version INT NOT NULL
+);
+INSERT INTO schema_version (version) VALUES (1);
 
 -- After setup, initialize with first player as 'bye'
 INSERT INTO players (name) VALUES ('bye');
\ No newline at end of file
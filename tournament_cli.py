@@ -0,0 +1,148 @@
+#!/usr/bin/env python
+#
+# tournament_cli.py -- command-line tool for running a tournament
+#
+#   tournament_cli.py register NAME...             register players
+#   tournament_cli.py register --tournament NAME   register a tournament
+#   tournament_cli.py enter TOURNAMENT PLAYER...
+#   tournament_cli.py report TOURNAMENT WINNER [LOSER] [--draw]
+#   tournament_cli.py standings TOURNAMENT [--top N]
+#   tournament_cli.py pair TOURNAMENT [--engine greedy]
+#   tournament_cli.py reset [--migrate]
+#
+# Ops scripts run one small command at a time, so this starts as quickly as
+# it can: tournament.py, and with it psycopg2, isn't imported until the
+# arguments have been parsed, and networkx is only imported by pair, when
+# swissPairings() needs the matching engine.  reset only runs the schema's
+# DDL when migrations are pending, and otherwise just empties the tables.
+# Output is tab separated, one row per line.  benchmark.py's startup report
+# times how long commands take to start.
+#
+
+import argparse
+import sys
+
+
+def register(args):
+    import tournament
+    for name in args.names:
+        if args.tournament:
+            print tournament.Tournament(name).id
+        else:
+            print tournament.registerPlayer(name)
+
+
+def enter(args):
+    import tournament
+    t = tournament.Tournament(None, args.tournament)
+    for player in args.players:
+        t.enterPlayer(player)
+
+
+def report(args):
+    import tournament
+    t = tournament.Tournament(None, args.tournament)
+    loser = tournament.BYE if args.loser is None else args.loser
+    if not t.reportMatch(args.winner, loser, args.draw, args.round,
+                         args.board):
+        print 'Already recorded'
+
+
+def standings(args):
+    import tournament
+    t = tournament.Tournament(None, args.tournament)
+    if args.top is None:
+        rows = t.playerStandings()
+    else:
+        rows = t.topStandings(args.top)
+    for row in rows:
+        print '\t'.join(str(column) for column in row)
+
+
+def pair(args):
+    import tournament
+    t = tournament.Tournament(None, args.tournament)
+    for pairing in t.swissPairings(args.engine, args.on_infeasible,
+                                   args.lookahead):
+        print '\t'.join(str(column) for column in pairing)
+
+
+def reset(args):
+    import tournament
+    if not args.migrate:
+        tournament.clearAll()
+        return
+    conn, cursor = tournament.connect()
+    migrated = tournament.migrate(cursor)
+    conn.commit()
+    print '{} migrations run, schema at version {}'.format(
+        migrated, tournament.schemaVersion(cursor))
+    conn.close()
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='tournament', description='Run a Swiss-system tournament.')
+    commands = parser.add_subparsers()
+
+    command = commands.add_parser(
+        'register', help='register players, printing their ids')
+    command.add_argument('names', nargs='+', metavar='NAME')
+    command.add_argument('--tournament', action='store_true',
+                         help='register tournaments instead of players')
+    command.set_defaults(func=register)
+
+    command = commands.add_parser(
+        'enter', help='enter players into a tournament')
+    command.add_argument('tournament', type=int)
+    command.add_argument('players', type=int, nargs='+', metavar='PLAYER')
+    command.set_defaults(func=enter)
+
+    command = commands.add_parser(
+        'report', help='report the result of a match, or a bye if no loser '
+                       'is given')
+    command.add_argument('tournament', type=int)
+    command.add_argument('winner', type=int)
+    command.add_argument('loser', type=int, nargs='?')
+    command.add_argument('--draw', action='store_true')
+    command.add_argument('--round', type=int)
+    command.add_argument('--board', type=int)
+    command.set_defaults(func=report)
+
+    command = commands.add_parser(
+        'standings', help='print id, name, wins, draws and losses of each '
+                          'player, first place first')
+    command.add_argument('tournament', type=int)
+    command.add_argument('--top', type=int,
+                         help='print only the top players')
+    command.set_defaults(func=standings)
+
+    command = commands.add_parser(
+        'pair', help='print pairings for the next round')
+    command.add_argument('tournament', type=int)
+    command.add_argument('--engine', default='blossom',
+                         help='blossom (default) or greedy')
+    command.add_argument('--on-infeasible', default='rematch',
+                         help='rematch (default), partial or raise')
+    command.add_argument('--lookahead', type=int, default=0)
+    command.set_defaults(func=pair)
+
+    command = commands.add_parser(
+        'reset', help='remove all players, tournaments and matches')
+    command.add_argument('--migrate', action='store_true',
+                         help='only run pending schema migrations, keeping '
+                              'all data')
+    command.set_defaults(func=reset)
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    try:
+        args.func(args)
+    except ValueError as e:
+        sys.exit(str(e))
+
+
+if __name__ == '__main__':
+    main()
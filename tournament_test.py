@@ -2,6 +2,22 @@
 #
 # Test cases for tournament.py
 
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+
+from async_tournament import AsyncClient
+from binary_export import TournamentExport
+from bulk_import import import_csv
+from generate_data import generate
+from binning_and_graph_construction import get_pairs
+from journal import TournamentState
+from pairing_service import (PairingClient, PairingService,
+                             UnixPairingServer, load_state)
+from speculative import SpeculativeRound
 from tournament import *
 
 BYE = 1             # player id for bye is 1
@@ -257,6 +273,702 @@ def testPairings():
     print ("9. After two matches, players are correctly matched up.")
 
 
+def testGreedyPairings():
+    clearAll()
+    # Register 6 players, saving their ids
+    p1 = registerPlayer("Twilight Sparkle")
+    p2 = registerPlayer("Fluttershy")
+    p3 = registerPlayer("Applejack")
+    p4 = registerPlayer("Pinkie Pie")
+    p5 = registerPlayer("Rarity")
+    p6 = registerPlayer("Rainbow Dash")
+    t = Tournament("WSOP 2012")
+    for p in [p1, p2, p3, p4, p5, p6]:
+        t.enterPlayer(p)
+    # First round - top half of the field beats the bottom half
+    t.reportMatch(p1, p4)
+    t.reportMatch(p2, p5)
+    t.reportMatch(p3, p6)
+    pairings = t.swissPairings(engine='greedy')
+    if len(pairings) != 3:
+        raise ValueError(
+            "For six players, greedy swissPairings should return three pairs.")
+    played = set([frozenset([p1, p4]), frozenset([p2, p5]),
+                  frozenset([p3, p6])])
+    winners = set([p1, p2, p3])
+    paired = set()
+    for (pid1, pname1, pid2, pname2) in pairings:
+        if frozenset([pid1, pid2]) in played:
+            raise ValueError("Greedy pairings should not contain rematches.")
+        paired.update([pid1, pid2])
+    if paired != set([p1, p2, p3, p4, p5, p6]):
+        raise ValueError("Greedy pairings should pair every player once.")
+    # Three winners can't all play each other, so exactly one floats down
+    crossing = [p for p in pairings if (p[0] in winners) != (p[2] in winners)]
+    if len(crossing) != 1:
+        raise ValueError(
+            "Greedy pairings should float one winner down to the losers.")
+    # The top-down pass alone leaves two players out of this field, though
+    # everyone can be paired without a rematch
+    field = [(3, "Player 3", 2, 0, 0, [2, 4], 6),
+             (2, "Player 2", 1, 0, 1, [3, 6], 9),
+             (4, "Player 4", 1, 0, 1, [5, 3], 9),
+             (5, "Player 5", 1, 0, 1, [4, BYE], 3),
+             (6, "Player 6", 1, 0, 1, [BYE, 2], 3)]
+    opponents = dict((p[0], p[5]) for p in field)
+    paired = set()
+    for (pid1, pname1, pid2, pname2) in get_pairs(field, 'greedy'):
+        if pid2 in opponents[pid1]:
+            raise ValueError("Greedy pairings should not contain rematches.")
+        paired.update([pid1, pid2])
+    if paired != set([2, 3, 4, 5, 6, BYE]):
+        raise ValueError(
+            "Greedy pairings should pair everyone when a pairing exists.")
+    print ("10. Greedy engine pairs every player with no rematches.")
+
+
+def testInfeasiblePairings():
+    clearAll()
+    p1 = registerPlayer("Twilight Sparkle")
+    p2 = registerPlayer("Fluttershy")
+    p3 = registerPlayer("Applejack")
+    p4 = registerPlayer("Pinkie Pie")
+    t = Tournament("WSOP 2013")
+    for p in [p1, p2, p3, p4]:
+        t.enterPlayer(p)
+    # Three rounds and everyone has played everyone
+    t.reportMatch(p1, p2)
+    t.reportMatch(p3, p4)
+    t.reportMatch(p1, p3)
+    t.reportMatch(p4, p2)
+    t.reportMatch(p2, p3)
+    t.reportMatch(p4, p1)
+    try:
+        t.swissPairings(on_infeasible='raise')
+    except ValueError:
+        pass
+    else:
+        raise ValueError(
+            "swissPairings should raise when no pairing without rematches "
+            "exists and on_infeasible is 'raise'.")
+    pairings = t.swissPairings()
+    if len(pairings) != 2:
+        raise ValueError(
+            "When a rematch is unavoidable, every player should still be "
+            "paired.")
+    correct_pairs = set([frozenset([p1, p2]), frozenset([p3, p4])])
+    actual_pairs = set(frozenset([p[0], p[2]]) for p in pairings)
+    if correct_pairs != actual_pairs:
+        raise ValueError(
+            "When a rematch is unavoidable, the least recent matches should "
+            "be replayed.")
+    # Forgiving the first round mustn't give player 6 a second bye
+    field = [(4, "Player 4", 2, 1, 0, [5, BYE, 3], 13),
+             (5, "Player 5", 2, 1, 0, [4, 2, 6], 13),
+             (3, "Player 3", 2, 0, 1, [2, 6, 4], 13),
+             (2, "Player 2", 1, 0, 2, [3, 5, BYE], 13),
+             (6, "Player 6", 1, 0, 2, [BYE, 3, 5], 13)]
+    for engine in ['blossom', 'greedy']:
+        for (pid1, pname1, pid2, pname2) in get_pairs(field, engine):
+            if pid2 == BYE and pid1 in [2, 4, 6]:
+                raise ValueError(
+                    "Forgiving rematches shouldn't give a second bye.")
+    print ("11. When rematches are unavoidable, the oldest are replayed.")
+
+
+def testStandingsPaging():
+    clearAll()
+    t = Tournament("WSOP 2014")
+    players = [registerPlayer("Player {}".format(i)) for i in range(7)]
+    for p in players:
+        t.enterPlayer(p)
+    t.reportMatch(players[0], players[1])
+    t.reportMatch(players[2], players[3])
+    t.reportDraw(players[4], players[5])
+    t.reportBye(players[6])
+    standings = t.playerStandings()
+    if list(t.iterStandings(batch_size=2)) != standings:
+        raise ValueError(
+            "iterStandings() should yield the same rows as playerStandings().")
+    pages = []
+    page = t.standingsPage(limit=3)
+    while page:
+        pages.extend(page)
+        page = t.standingsPage(after=page[-1][0], limit=3)
+    if pages != standings:
+        raise ValueError(
+            "Pages from standingsPage() should add up to playerStandings().")
+    if t.topStandings(4) != standings[:4]:
+        raise ValueError(
+            "topStandings(4) should return the first four players.")
+    print ("12. Standings can be streamed and paged.")
+
+
+def testJournalReplay():
+    clearAll()
+    journal_dir = tempfile.mkdtemp()
+    t = Tournament("WSOP 2015", journal_dir=journal_dir)
+    try:
+        players = [registerPlayer("Player {}".format(i)) for i in range(4)]
+        players.append(registerPlayer("Jos\xc3\xa9 Capablanca"))
+        for p in players:
+            t.enterPlayer(p)
+        t.reportMatch(players[0], players[1])
+        t.reportDraw(players[2], players[3])
+        t.reportBye(players[4])
+        path = journalPath(journal_dir, t.id)
+        snapshot = path + '.snapshot'
+        TournamentState.recover(path).saveSnapshot(snapshot)
+        t.reportMatch(players[3], players[0])
+        t.removePlayer(players[1])
+        state = TournamentState.recover(path, snapshot)
+        replayed = set((id, name.encode('utf-8'), w, d, l)
+                       for (id, name, w, d, l, o, p) in state.playerInfo())
+        if replayed != set(t.playerStandings()):
+            raise ValueError(
+                "Replaying the journal from a snapshot should give the same "
+                "standings as the database.")
+        replayed = set((p[0], p[6]) for p in state.playerInfo())
+        if replayed != set((p[0], p[3]) for p in t.playerTiebreaks()):
+            raise ValueError(
+                "Replayed opponent points should leave out removed players, "
+                "as the database does.")
+    finally:
+        t.close()
+        shutil.rmtree(journal_dir)
+    print ("13. Standings can be rebuilt from a snapshot and the journal.")
+
+
+def testExportImport():
+    clearAll()
+    t = Tournament("WSOP 2016")
+    players = [registerPlayer(name) for name in
+               ["Bruno Walton", "Boots O'Neal", "Cathy\tBurton", "Diane Grant",
+                "Atlanta Hope"]]
+    for p in players:
+        t.enterPlayer(p)
+    t.reportMatch(players[0], players[1])
+    t.reportDraw(players[2], players[3])
+    t.reportBye(players[4])
+    fd, path = tempfile.mkstemp()
+    os.close(fd)
+    try:
+        t.export(path)
+        imported = Tournament.import_(path, "WSOP 2016 copy")
+        export = TournamentExport(path)
+    finally:
+        os.remove(path)
+    if countPlayers() != 10:
+        raise ValueError("Importing should register every player afresh.")
+    original = sorted((n, w, d, l) for (i, n, w, d, l) in t.playerStandings())
+    copied = sorted((n, w, d, l)
+                    for (i, n, w, d, l) in imported.playerStandings())
+    if original != copied:
+        raise ValueError(
+            "An imported tournament should have the same standings.")
+    conn, cursor = connect()
+    cursor.execute("""SELECT player, points, buchholz, median_buchholz,
+                             sonneborn_berger
+                      FROM compute_player_scores_from_tourn(%s);""",
+                   [imported.id])
+    recomputed = dict((row[0], row[1:]) for row in cursor.fetchall())
+    conn.close()
+    if dict((row[0], row[2:])
+            for row in imported.playerTiebreaks()) != recomputed:
+        raise ValueError(
+            "An imported tournament's tiebreaks should match those "
+            "recomputed from its matches.")
+    if len(get_pairs(export.playerInfo())) != 3:
+        raise ValueError(
+            "get_pairs() should pair players straight from an export.")
+    print ("14. Tournaments can be exported and imported.")
+
+
+def testBulkImport():
+    clearAll()
+    csv_dir = tempfile.mkdtemp()
+    try:
+        paths = {}
+        files = {
+            'players': "name\nBruno Walton\nBoots O'Neal\n",
+            'entries': "tournament,player\nWSOP 2017,Bruno Walton\n"
+                       "WSOP 2017,Boots O'Neal\nWSOP 2017,Cathy Burton\n",
+            'results': "tournament,winner,loser,draw\n"
+                       "WSOP 2017,Bruno Walton,Boots O'Neal,\n"
+                       "WSOP 2017,Cathy Burton,bye,\n"
+                       "WSOP 2017,Boots O'Neal,Cathy Burton,t\n",
+        }
+        for kind, data in files.items():
+            paths[kind] = os.path.join(csv_dir, kind + '.csv')
+            with open(paths[kind], 'w') as f:
+                f.write(data)
+        counts = import_csv(paths['players'], paths['entries'],
+                            paths['results'])
+    finally:
+        shutil.rmtree(csv_dir)
+    if counts != {'players': 3, 'tournaments': 1, 'entries': 3,
+                  'matches': 3}:
+        raise ValueError("Bulk import should report the rows it inserted.")
+    (id, name) = getTournamentByName("WSOP 2017")[0]
+    standings = set((n, w, d, l) for (i, n, w, d, l) in
+                    Tournament(name, id).playerStandings())
+    if standings != set([("Bruno Walton", 1, 0, 0),
+                         ("Boots O'Neal", 0, 1, 1),
+                         ("Cathy Burton", 1, 1, 0)]):
+        raise ValueError(
+            "Bulk imported results should show up in the standings.")
+    print ("15. Players, entries and results can be bulk imported from CSV.")
+
+
+def testAsyncTournament():
+    clearAll()
+    t = Tournament("WSOP 2018")
+    players = [registerPlayer("Player {}".format(i)) for i in range(6)]
+    client = AsyncClient(connections=4, pair_processes=1)
+    journal_dir = tempfile.mkdtemp()
+    try:
+        at = client.tournament(t.id, t.name, journal_dir=journal_dir)
+        for result in [at.enterPlayer(p) for p in players]:
+            result.get()
+        reports = [at.reportMatch(players[0], players[1], round=1, board=1),
+                   at.reportMatch(players[2], players[3], round=1, board=2),
+                   at.reportMatch(players[4], players[5], draw=True,
+                                  round=1, board=3)]
+        for result in reports:
+            result.get()
+        if at.reportMatch(players[0], players[1], round=1, board=1).get():
+            raise ValueError(
+                "AsyncTournament should not record a board's result twice.")
+        standings = at.playerStandings().get()
+        pairings = at.swissPairings().get()
+        at.close()
+        state = TournamentState.recover(journalPath(journal_dir, t.id))
+    finally:
+        client.close()
+        shutil.rmtree(journal_dir)
+    if standings != t.playerStandings():
+        raise ValueError("AsyncTournament standings should match Tournament.")
+    replayed = set((id, name.encode('utf-8'), w, d, l)
+                   for (id, name, w, d, l, o, p) in state.playerInfo())
+    if replayed != set(standings):
+        raise ValueError(
+            "AsyncTournament should journal its entries and reports.")
+    if len(pairings) != 3:
+        raise ValueError(
+            "For six players, AsyncTournament.swissPairings should return "
+            "three pairs.")
+    print ("16. AsyncTournament enters, reports, ranks and pairs players.")
+
+
+def testDuplicateReports():
+    clearAll()
+    p1 = registerPlayer("Bruno Walton")
+    p2 = registerPlayer("Boots O'Neal")
+    t = Tournament("WSOP 2019")
+    t.enterPlayer(p1)
+    t.enterPlayer(p2)
+    if not t.reportMatch(p1, p2, round=1, board=1):
+        raise ValueError("The first report of a board should be recorded.")
+    if t.reportMatch(p1, p2, round=1, board=1):
+        raise ValueError(
+            "Reporting the same result for a board again should not record "
+            "it twice.")
+    try:
+        t.reportMatch(p2, p1, round=1, board=1)
+    except ValueError:
+        pass
+    else:
+        raise ValueError(
+            "Reporting a different result for a board should raise.")
+    standings = dict((i, (w, d, l)) for (i, n, w, d, l) in
+                     t.playerStandings())
+    if standings[p1] != (1, 0, 0) or standings[p2] != (0, 0, 1):
+        raise ValueError("A board reported twice should count once.")
+    print ("17. Duplicate reports of a board are recorded only once.")
+
+
+def testFinishTournament():
+    clearAll()
+    p1 = registerPlayer("Bruno Walton")
+    p2 = registerPlayer("Boots O'Neal")
+    t1 = Tournament("WSOP 2020")
+    t2 = Tournament("WSOP 2021")
+    for t in [t1, t2]:
+        t.enterPlayer(p1)
+        t.enterPlayer(p2)
+        t.reportMatch(p1, p2)
+    standings = t1.playerStandings()
+    t1.finish()
+    if t1.playerStandings() != standings:
+        raise ValueError(
+            "A finished tournament should keep its final standings.")
+    conn, cursor = connect()
+    cursor.execute("SELECT COUNT(*) FROM matches;")
+    live_matches = cursor.fetchone()[0]
+    cursor.execute("SELECT COUNT(*) FROM archive.matches_%s;", [t1.id])
+    archived_matches = cursor.fetchone()[0]
+    conn.close()
+    if live_matches != 1 or archived_matches != 1:
+        raise ValueError(
+            "A finished tournament's matches should move to the archive.")
+    if t2.countPlayers() != 2:
+        raise ValueError(
+            "Finishing a tournament should not affect other tournaments.")
+    try:
+        t1.reportMatch(p2, p1)
+    except ValueError:
+        pass
+    else:
+        raise ValueError(
+            "Reporting a match in a finished tournament should fail.")
+    for change in [t1.enterPlayer, t1.removePlayer]:
+        try:
+            change(p2)
+        except ValueError:
+            pass
+        else:
+            raise ValueError(
+                "Entering or removing players in a finished tournament "
+                "should fail.")
+    deleteTournaments()
+    conn, cursor = connect()
+    cursor.execute("""SELECT COUNT(*) FROM pg_tables
+                      WHERE tablename LIKE 'matches\\_%'
+                         OR tablename LIKE 'tournament\\_players\\_%';""")
+    partitions = cursor.fetchone()[0]
+    conn.close()
+    if partitions:
+        raise ValueError(
+            "Deleting tournaments should drop their partitions, live or "
+            "archived.")
+    print ("18. Finished tournaments keep final standings and are archived.")
+
+
+def testPairingService():
+    clearAll()
+    t = Tournament("WSOP 2022")
+    players = [registerPlayer("Player {}".format(i)) for i in range(4)]
+    socket_dir = tempfile.mkdtemp()
+    server = UnixPairingServer(os.path.join(socket_dir, 'pairing.sock'),
+                               PairingService())
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    try:
+        client = PairingClient(path=server.server_address)
+        for p in players:
+            client.enterPlayer(t.id, p)
+        client.reportMatch(t.id, players[0], players[1])
+        client.reportMatch(t.id, players[2], players[3], draw=True)
+        standings = client.playerStandings(t.id)
+        pairings = client.swissPairings(t.id)
+        client.close()
+    finally:
+        server.shutdown()
+        server.server_close()
+        shutil.rmtree(socket_dir)
+    if set(standings) != set(t.playerStandings()):
+        raise ValueError(
+            "Pairing service standings should match the database.")
+    played = set([frozenset([players[0], players[1]]),
+                  frozenset([players[2], players[3]])])
+    if len(pairings) != 2 or any(frozenset([p[0], p[2]]) in played
+                                 for p in pairings):
+        raise ValueError(
+            "Pairing service should pair everyone without rematches.")
+    print ("19. The pairing service reports, ranks and pairs players.")
+
+
+def testAllStandings():
+    clearAll()
+    players = [registerPlayer("Player {}".format(i)) for i in range(4)]
+    t1 = Tournament("WSOP 2023")
+    t2 = Tournament("WSOP 2024")
+    t3 = Tournament("WSOP 2025")
+    for t in [t1, t2, t3]:
+        for p in players:
+            t.enterPlayer(p)
+    t1.reportMatch(players[0], players[1])
+    t2.reportMatch(players[3], players[2])
+    standings = allStandings([t1.id, t2.id], top=2)
+    if standings.keys() != [(t1.id, t1.name), (t2.id, t2.name)]:
+        raise ValueError(
+            "allStandings() should return only the tournaments asked for, "
+            "in id order.")
+    for t in [t1, t2]:
+        if standings[(t.id, t.name)] != t.playerStandings()[:2]:
+            raise ValueError(
+                "allStandings() should return each tournament's top players.")
+    if set(allStandings()) != set(getTournaments()):
+        raise ValueError(
+            "allStandings() should default to all tournaments, keyed as "
+            "getTournaments() returns them.")
+    t4 = Tournament("WSOP 2025 Seniors")
+    if allStandings([t4.id], top=2) != {(t4.id, t4.name): []}:
+        raise ValueError(
+            "allStandings() should return tournaments with no players.")
+    print ("20. Standings for many tournaments come back in one query.")
+
+
+def testTiebreaks():
+    clearAll()
+    t = Tournament("WSOP 2026")
+    players = [registerPlayer("Player {}".format(i)) for i in range(5)]
+    for p in players:
+        t.enterPlayer(p)
+    t.reportMatch(players[0], players[1])
+    t.reportDraw(players[2], players[3])
+    t.reportBye(players[4])
+    t.reportMatch(players[0], players[2])
+    t.reportMatch(players[1], players[4])
+    t.reportDraw(players[3], players[0])
+    t.reportMatch(players[0], players[1])
+
+    def recomputed():
+        conn, cursor = connect()
+        cursor.execute("""SELECT player, points, buchholz, median_buchholz,
+                                 sonneborn_berger
+                          FROM compute_player_scores_from_tourn(%s);""",
+                       [t.id])
+        scores = dict((row[0], row[1:]) for row in cursor.fetchall())
+        conn.close()
+        return scores
+
+    tiebreaks = t.playerTiebreaks()
+    if dict((row[0], row[2:]) for row in tiebreaks) != recomputed():
+        raise ValueError(
+            "Tiebreaks kept up to date should match those recomputed from "
+            "the matches.")
+    # Player 0 has 10 points from beating 1 twice and 2, and drawing with 3,
+    # whose 2 points count half
+    if tiebreaks[0][0] != players[0] or tiebreaks[0][5] != 3 + 3 + 1 + 1:
+        raise ValueError("Sonneborn-Berger should weight opponents by result.")
+    if ([p[0] for p in load_state(t.id).playerInfo()] !=
+            [row[0] for row in tiebreaks]):
+        raise ValueError(
+            "Standings kept in memory should be ranked by the same "
+            "tiebreaks as the database.")
+    t.removePlayer(players[1])
+    if dict((row[0], row[2:]) for row in t.playerTiebreaks()) != recomputed():
+        raise ValueError(
+            "Removing a player should update their opponents' tiebreaks.")
+    print ("21. Tiebreaks are kept up to date as matches are reported.")
+
+
+def testLookaheadPairings():
+    clearAll()
+    t = Tournament("WSOP 2027")
+    players = [registerPlayer("Player {}".format(i)) for i in range(6)]
+    for p in players:
+        t.enterPlayer(p)
+    p1, p2, p3, p4, p5, p6 = players
+    t.reportMatch(p2, p1)
+    t.reportMatch(p4, p3)
+    t.reportMatch(p6, p5)
+    t.reportMatch(p5, p1)
+    t.reportMatch(p2, p4)
+    t.reportMatch(p6, p3)
+    # Paired without lookahead, this round leaves no pairing for the next
+    # without a rematch.  Looking ahead, all five rounds can be played
+    for lookahead in [2, 1, 0]:
+        try:
+            pairings = t.swissPairings(on_infeasible='raise',
+                                       lookahead=lookahead)
+        except ValueError:
+            raise ValueError(
+                "Lookahead should avoid pairings that lead to a round with "
+                "no pairing without rematches.")
+        for (pid1, pname1, pid2, pname2) in pairings:
+            t.reportMatch(pid1, pid2)
+    print ("22. Lookahead pairing avoids dead ends in later rounds.")
+
+
+def testSpeculativePairings():
+    clearAll()
+    t = Tournament("WSOP 2028")
+    players = [registerPlayer("Player {}".format(i)) for i in range(4)]
+    for p in players:
+        t.enterPlayer(p)
+    current = SpeculativeRound(t, t.swissPairings(), round=1, processes=2,
+                               max_speculations=3)
+    try:
+        boards = list(current.boards)
+        current.reportMatch(*boards[0])
+        if current.speculated != 3:
+            raise ValueError(
+                "With one board left, all three of its results should be "
+                "paired ahead.")
+        current.reportMatch(boards[1][1], boards[1][0])
+        pairings = current.nextPairings(wait=True)
+    finally:
+        current.close()
+    pairs = set(frozenset([p[0], p[2]]) for p in pairings)
+    if pairs != set(frozenset([p[0], p[2]]) for p in t.swissPairings()):
+        raise ValueError(
+            "Speculative pairings should match pairing after the last "
+            "report.")
+    print ("23. The next round is paired while the last boards play.")
+
+
+def testProjectStandings():
+    clearAll()
+    t = Tournament("WSOP 2029")
+    players = [registerPlayer("Player {}".format(i)) for i in range(8)]
+    for p in players:
+        t.enterPlayer(p)
+    for i in range(0, 8, 2):
+        t.reportMatch(players[i], players[i+1])
+    projection = t.projectStandings(2, simulations=2000, top=4)
+    if len(projection) != 8:
+        raise ValueError("Every player should have a projection.")
+    if abs(sum(p[2] for p in projection) - 4) > 1e-9:
+        raise ValueError("Top 4 odds should add up to four players.")
+    for (id, name, top_odds, mean_place, places) in projection:
+        if abs(places.sum() - 1) > 1e-9:
+            raise ValueError(
+                "Each player should finish somewhere in every simulation.")
+    odds = dict((p[0], p[2]) for p in projection)
+    if min(odds[p] for p in players[0::2]) <= max(odds[p] for p in
+                                                  players[1::2]):
+        raise ValueError(
+            "Winners of the first round should be likelier to make the top "
+            "cut than its losers.")
+    print ("24. Final standings can be projected by simulation.")
+
+
+def testGenerateData():
+    def generated():
+        clearAll()
+        counts = generate(tournaments=3, players=20, min_field=5,
+                          max_field=9, seed=1)
+        conn, cursor = connect()
+        cursor.execute("""SELECT tournament, round, board, winner, loser,
+                                 draw
+                          FROM matches ORDER BY tournament, round, board;""")
+        matches = cursor.fetchall()
+        cursor.execute("""SELECT COUNT(*) FROM matches
+                          WHERE loser <> %s
+                          GROUP BY tournament, LEAST(winner, loser),
+                                   GREATEST(winner, loser)
+                          HAVING COUNT(*) > 1;""", [BYE])
+        rematches = cursor.fetchall()
+        conn.close()
+        return counts, matches, rematches
+
+    counts, matches, rematches = generated()
+    if counts['tournaments'] != 3 or counts['matches'] != len(matches):
+        raise ValueError("Generated rows should all be loaded.")
+    if rematches:
+        raise ValueError("Generated tournaments should have no rematches.")
+    for t in getTournaments():
+        tournament = Tournament(t[1], t[0])
+        if len(tournament.playerTiebreaks()) != tournament.countPlayers():
+            raise ValueError(
+                "Generated tournaments should have their scores built.")
+    if generated()[1] != matches:
+        raise ValueError(
+            "Generating again with the same seed should give the same "
+            "matches.")
+    print ("25. Synthetic tournaments can be generated reproducibly.")
+
+
+def testReadReplica():
+    # Set TOURNAMENT_TEST_REPLICA_DSN to test against a real replica; by
+    # default a second connection string to the same database stands in
+    clearAll()
+    configure(replica=os.environ.get(
+        'TOURNAMENT_TEST_REPLICA_DSN',
+        'dbname=tournament application_name=tournament_replica'))
+    try:
+        servers = []
+        for read in (False, True):
+            conn, cursor = connect(read=read)
+            cursor.execute("""SELECT current_setting('application_name'),
+                                     pg_is_in_recovery();""")
+            servers.append(cursor.fetchone())
+            conn.close()
+        if servers[0] == servers[1]:
+            raise ValueError("Reads should go to the replica.")
+        t = Tournament("Replicated", read_your_writes=True)
+        p1 = registerPlayer("Alicia Markova")
+        p2 = registerPlayer("Anton Dolin")
+        if countPlayers() != 2:
+            raise ValueError(
+                "Module-level reads should see this thread's own writes.")
+        t.enterPlayer(p1)
+        t.enterPlayer(p2)
+        t.reportMatch(p1, p2)
+        if t.written_lsn is None:
+            raise ValueError(
+                "Sessions reading their own writes should note where the "
+                "last one was.")
+        if t.playerStandings()[0][:3] != (p1, "Alicia Markova", 1):
+            raise ValueError(
+                "A score-keeper should see their own report at once.")
+        other = Tournament(t.name, t.id)
+        other.reportBye(p2)
+        if other.written_lsn is not None:
+            raise ValueError(
+                "Other sessions shouldn't wait for the replica.")
+        fd, path = tempfile.mkstemp()
+        os.close(fd)
+        try:
+            t.export(path)
+            imported = Tournament.import_(path, read_your_writes=True)
+        finally:
+            os.remove(path)
+        if imported.written_lsn is None:
+            raise ValueError(
+                "Importing should note where its write was, like any other.")
+        records = [row[2:] for row in t.playerStandings()]
+        if [row[2:] for row in imported.playerStandings()] != records:
+            raise ValueError(
+                "An imported tournament's standings should be read at once.")
+    finally:
+        configure(os.environ.get('TOURNAMENT_DSN'),
+                  os.environ.get('TOURNAMENT_REPLICA_DSN'))
+    print ("26. Reads can be sent to a replica, seeing a session's own "
+           "writes.")
+
+
+def testCommandLine():
+    def run(*args):
+        return subprocess.check_output(
+            [sys.executable] + list(args),
+            cwd=os.path.dirname(os.path.abspath(__file__)))
+
+    clearAll()
+    t = Tournament("Archived")
+    t.finish()
+    clearAll()
+    conn, cursor = connect()
+    version = schemaVersion(cursor)
+    conn.close()
+    if version != len(MIGRATIONS):
+        raise ValueError("The schema should be fully migrated.")
+    if Tournament("Fresh").id != 1 or registerPlayer("Nobody") != 2:
+        raise ValueError("Clearing should start ids again after the bye.")
+    if run('-c', 'import sys, tournament; '
+                 'print "networkx" in sys.modules').strip() != 'False':
+        raise ValueError(
+            "Importing tournament shouldn't import the matching engine.")
+    tournament_id = run('tournament_cli.py', 'register', '--tournament',
+                        'Command Line Open').strip()
+    players = run('tournament_cli.py', 'register', 'Judit Polgar',
+                  'Hou Yifan').split()
+    run('tournament_cli.py', 'enter', tournament_id, *players)
+    run('tournament_cli.py', 'report', tournament_id, players[1], players[0])
+    standings = [line.split('\t') for line in run(
+        'tournament_cli.py', 'standings', tournament_id).splitlines()]
+    if standings != [[players[1], 'Hou Yifan', '1', '0', '0'],
+                     [players[0], 'Judit Polgar', '0', '0', '1']]:
+        raise ValueError("The command-line tool should report standings.")
+    if len(run('tournament_cli.py', 'pair', tournament_id).splitlines()) != 1:
+        raise ValueError("The command-line tool should pair the next round.")
+    print ("27. The command-line tool starts without the matching engine, and "
+           "the schema is only set up when out of date.")
+
+
 if __name__ == '__main__':
     clearAll()
     testDeleteMatches()
@@ -268,6 +980,24 @@ if __name__ == '__main__':
     testReportMatches()
     testEmptyPairings()
     testPairings()
+    testGreedyPairings()
+    testInfeasiblePairings()
+    testStandingsPaging()
+    testJournalReplay()
+    testExportImport()
+    testBulkImport()
+    testAsyncTournament()
+    testDuplicateReports()
+    testFinishTournament()
+    testPairingService()
+    testAllStandings()
+    testTiebreaks()
+    testLookaheadPairings()
+    testSpeculativePairings()
+    testProjectStandings()
+    testGenerateData()
+    testReadReplica()
+    testCommandLine()
     print "Success!  All tests pass!"
 
 